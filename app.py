@@ -4,11 +4,15 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
-from transformers import RobertaTokenizer, RobertaForSequenceClassification
+from transformers import RobertaTokenizer, RobertaTokenizerFast, RobertaForSequenceClassification, RobertaConfig
 from datetime import datetime, timedelta
 import json
 import os
 import hashlib
+import base64
+import urllib.parse
+import re
+import html
 import time
 from pathlib import Path
 from gradio_client import Client
@@ -23,7 +27,42 @@ import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')  # Use non-interactive backend
 import io
+import copy
+import functools
 import tempfile
+import zipfile
+import inspect
+import logging
+import socket
+import threading
+import atexit
+import sqlite3
+import queue
+import mmap
+import struct
+from contextlib import contextmanager
+import transformers
+from transformers.models.roberta.modeling_roberta import RobertaClassificationHead
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from types import SimpleNamespace
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no flock on Windows; the event log is then only safe within one process
+
+logger = logging.getLogger("soul")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.setLevel(logging.INFO)
 
 # Page configuration
 st.set_page_config(
@@ -34,6 +73,96 @@ st.set_page_config(
 )
 HUGGINGFACE_MODEL_NAME = "krishsinghal006/emotion-roberta-soul" 
 
+# Inference settings
+# SOUL_MODEL_PATH may point at a local checkpoint directory instead of the Hub repository.
+# A directory with model.safetensors and tokenizer.json is loaded fully offline with memory-mapped weights.
+MODEL_SOURCE = os.environ.get("SOUL_MODEL_PATH", HUGGINGFACE_MODEL_NAME)
+MODEL_BACKEND = os.environ.get("SOUL_MODEL_BACKEND", "torch")  # 'torch', 'traced', 'bf16', 'onnx' or 'quantized'
+MODEL_CACHE_DIR = Path(os.environ.get("SOUL_MODEL_CACHE_DIR", "model_cache"))
+BUNDLED_EMOTION_LABELS_FILE = Path(__file__).parent / "emotion_labels.json"
+MAX_SEQUENCE_LENGTH = 128
+INFERENCE_BATCH_SIZE = int(os.environ.get("SOUL_INFERENCE_BATCH_SIZE", "32"))
+ONNX_PARITY_TOLERANCE = 1e-3
+WARMUP_SEQUENCE_LENGTHS = (16, 32, 64, MAX_SEQUENCE_LENGTH)
+MODEL_READY_POLL_SECONDS = 1.0  # how often model pages rerun while the model is still loading
+# The traced backend compiles one graph per bucket and pads each batch up to the nearest one
+SEQUENCE_LENGTH_BUCKETS = (16, 32, 64, MAX_SEQUENCE_LENGTH)
+TRACED_PARITY_TOLERANCE = 1e-3
+# bf16 is only enabled if it picks the same top-1 emotion as fp32 on the validation texts
+BF16_MIN_TOP1_AGREEMENT = float(os.environ.get("SOUL_BF16_MIN_TOP1_AGREEMENT", "0.98"))
+VALIDATION_TEXTS_FILE = os.environ.get("SOUL_VALIDATION_TEXTS")  # optional CSV with a 'text' column
+# Representative inputs used for backend parity checks and latency comparisons
+BENCHMARK_TEXTS = [
+    "I'm so happy and excited about my new job!",
+    "I feel really sad and lonely today.",
+    "This is making me so angry and frustrated!",
+    "I'm terrified of what might happen tomorrow, I can't stop thinking about it.",
+    "I'm grateful for all the support I've received.",
+    "I can't believe this is happening, I'm shocked!",
+    "Thanks, that's a really helpful explanation.",
+    "I miss my grandmother so much since she passed away last year.",
+    "Ugh, the bus is late again.",
+    "I'm not sure what you mean by that, can you explain?",
+    "I keep replaying the mistake I made at work and feel awful about it.",
+    "Honestly I'm just tired. Nothing in particular happened today, I just feel drained and want to sleep."
+]
+CSV_CHUNK_SIZE = int(os.environ.get("SOUL_CSV_CHUNK_SIZE", "2000"))
+SOCIAL_MEDIA_PREVIEW_ROWS = 500
+# Streamlit holds download data in memory, so larger result exports are zipped or withheld
+SOCIAL_MEDIA_DOWNLOAD_MAX_MB = int(os.environ.get("SOUL_DOWNLOAD_MAX_MB", "100"))
+RESULT_CACHE_SIZE = int(os.environ.get("SOUL_RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_DIR = os.environ.get("SOUL_RESULT_CACHE_DIR")  # optional persistent tier
+# Once the persistent tier holds more files than this, the least recently used tenth is deleted
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("SOUL_RESULT_CACHE_DISK_MAX_ENTRIES", "200000"))
+INFERENCE_WORKER_ENABLED = os.environ.get("SOUL_INFERENCE_WORKER", "1") == "1"
+MICRO_BATCH_WAIT_MS = float(os.environ.get("SOUL_MICRO_BATCH_WAIT_MS", "5"))
+# Seconds to wait for the shared worker before classifying in the calling thread instead
+INFERENCE_WORKER_TIMEOUT = float(os.environ.get("SOUL_INFERENCE_WORKER_TIMEOUT", "30"))
+# Long-text mode scores overlapping windows instead of truncating at MAX_SEQUENCE_LENGTH
+LONG_TEXT_WINDOW_OVERLAP = 32
+LONG_TEXT_MAX_WINDOWS = 8
+LONG_TEXT_AGGREGATION = os.environ.get("SOUL_LONG_TEXT_AGGREGATION", "mean")  # 'mean' or 'max'
+MAX_TIMELINE_SENTENCES = 64
+# Similar-entry search: exact dot product for small histories, IVF partitions above this size
+EMBEDDING_STORE_SIZE = RESULT_CACHE_SIZE
+EMBEDDING_IVF_MIN_ENTRIES = 4096
+EMBEDDING_IVF_PROBES = 8
+# Word-occlusion explanations are computed on request and stop once the time budget is spent
+EXPLANATION_TIME_BUDGET = float(os.environ.get("SOUL_EXPLANATION_TIME_BUDGET", "3.0"))
+EXPLANATION_CACHE_SIZE = 1000
+EXPLANATION_CACHE_DISK_MAX_ENTRIES = 20000
+# Cascade mode: a fast model (e.g. the distilled student) answers first and the full model
+# only sees inputs it is unsure about or that touch a high-risk emotion
+CASCADE_FAST_MODEL_PATH = os.environ.get("SOUL_CASCADE_FAST_MODEL")
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("SOUL_CASCADE_MIN_CONFIDENCE", "0.6"))
+CASCADE_MIN_MARGIN = float(os.environ.get("SOUL_CASCADE_MIN_MARGIN", "0.2"))
+CASCADE_RISK_TOP_K = int(os.environ.get("SOUL_CASCADE_RISK_TOP_K", "5"))
+# Early exit: intermediate-layer heads trained in the notebook let confident inputs skip the remaining layers
+EARLY_EXIT_ENABLED = os.environ.get("SOUL_EARLY_EXIT", "0") == "1"
+EARLY_EXIT_THRESHOLD = float(os.environ.get("SOUL_EARLY_EXIT_THRESHOLD", "0.9"))
+EARLY_EXIT_HEADS_FILE = "early_exit_heads.safetensors"
+EARLY_EXIT_CONFIG_FILE = "early_exit.json"
+# Startup autotuning of CPU threads, batch size and backend; the winner is cached per host
+AUTOTUNE_ENABLED = os.environ.get("SOUL_AUTOTUNE", "0") == "1"
+AUTOTUNE_BACKENDS = os.environ.get("SOUL_AUTOTUNE_BACKENDS", "torch,traced,bf16,quantized,onnx").split(",")
+AUTOTUNE_BATCH_SIZES = (8, 16, 32, 64)
+AUTOTUNE_SEQUENCES = 64
+
+# User storage: SQLite in WAL mode; users.json and gratitude.json are imported on first start
+USER_DB_PATH = Path(os.environ.get("SOUL_USER_DB", "soul.db"))
+LEGACY_USERS_FILE = Path("users.json")
+LEGACY_GRATITUDE_FILE = Path("gratitude.json")
+# New emotion entries, chat messages and DASS results are appended to a per-user log
+# and folded into the database by a background compactor
+USER_EVENT_LOG_DIR = Path(os.environ.get("SOUL_USER_EVENT_LOG_DIR", "user_events"))
+USER_EVENT_COMPACT_SECONDS = float(os.environ.get("SOUL_USER_EVENT_COMPACT_SECONDS", "30"))
+# Session autosave only writes changed fields, coalescing the changes made within this window
+AUTOSAVE_DEBOUNCE_SECONDS = float(os.environ.get("SOUL_AUTOSAVE_DEBOUNCE_SECONDS", "2.0"))
+# XP awards, Mind Gym tasks, gratitude entries and community posts are written behind the request
+WRITE_BEHIND_FLUSH_SECONDS = float(os.environ.get("SOUL_WRITE_BEHIND_FLUSH_SECONDS", "0.5"))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get("SOUL_WRITE_BEHIND_MAX_PENDING", "100"))
+COMMUNITY_POSTS_FILE = Path("community_posts.json")
+
 st.markdown("""
     <style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&family=Playfair+Display:wght@400;500;600;700&display=swap');
@@ -432,6 +561,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Mental Health Risk Mapping
+RISK_WEIGHTS = {'high': 3, 'medium': 2, 'low': 1}
 MENTAL_HEALTH_MAPPING = {
     'admiration': {'risk_level': 'low', 'concern': 'positive', 'color': 'green'},
     'amusement': {'risk_level': 'low', 'concern': 'positive', 'color': 'green'},
@@ -598,68 +728,607 @@ def count_answered_questions(responses):
     
     return answered, total
 
+# ======================
+# USER STORAGE
+# ======================
+USER_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password TEXT NOT NULL,
+    email TEXT,
+    registered_date TEXT,
+    last_login TEXT,
+    dass_completed INTEGER NOT NULL DEFAULT 0,
+    analysis_count INTEGER NOT NULL DEFAULT 0,
+    last_analysis_time TEXT,
+    social_media_results TEXT,
+    streak_count INTEGER NOT NULL DEFAULT 0,
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    last_checkin_date TEXT,
+    event_seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS emotion_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    timestamp TEXT,
+    text TEXT,
+    emotions TEXT,
+    risk_score REAL,
+    source TEXT,
+    embedding BLOB,
+    embedding_model TEXT
+);
+CREATE INDEX IF NOT EXISTS emotion_entries_user_time ON emotion_entries (username, timestamp);
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    role TEXT,
+    content TEXT,
+    timestamp TEXT,
+    emotions TEXT,
+    risk_score REAL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_user_time ON chat_messages (username, timestamp);
+CREATE TABLE IF NOT EXISTS dass_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+    timestamp TEXT,
+    scores TEXT,
+    severity TEXT,
+    completion_percentage REAL
+);
+CREATE INDEX IF NOT EXISTS dass_results_user_time ON dass_results (username, timestamp);
+CREATE TABLE IF NOT EXISTS mind_gym (
+    username TEXT PRIMARY KEY REFERENCES users(username) ON DELETE CASCADE,
+    xp INTEGER NOT NULL DEFAULT 0,
+    level INTEGER NOT NULL DEFAULT 1,
+    completed_tasks TEXT NOT NULL DEFAULT '[]'
+);
+CREATE TABLE IF NOT EXISTS gratitude_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    entry TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS gratitude_entries_user_time ON gratitude_entries (username, timestamp);
+"""
+
+EMOTION_ENTRY_COLUMNS = ('timestamp', 'text', 'emotions', 'risk_score', 'source', 'embedding', 'embedding_model')
+CHAT_MESSAGE_COLUMNS = ('role', 'content', 'timestamp', 'emotions', 'risk_score')
+DASS_RESULT_COLUMNS = ('timestamp', 'scores', 'severity', 'completion_percentage')
+
+class UserRecordCache:
+    """
+    Process-wide cache of parsed per-user records (profile row, Mind Gym progress, gratitude entries)
+    
+    A write through the storage helpers drops that user's records at once.
+    Any change to the database or WAL file's size or mtime drops everything,
+    so writes by other processes are picked up too; the files are checked at
+    most every external_check_seconds. Callers get their own copies, so
+    nothing they do can change the shared records.
+    """
+    
+    def __init__(self, db_path, external_check_seconds=0.5):
+        self.db_path = Path(db_path)
+        self.external_check_seconds = external_check_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._file_state = self._read_file_state()
+        self._checked_at = time.monotonic()
+        self.version = 0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+    
+    def _read_file_state(self):
+        state = []
+        for path in (self.db_path, self.db_path.with_name(self.db_path.name + "-wal")):
+            try:
+                stat = path.stat()
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+    
+    @staticmethod
+    def _copy(value):
+        """Copy of a JSON-like record; much cheaper than copy.deepcopy for these small structures"""
+        if isinstance(value, dict):
+            return {key: UserRecordCache._copy(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [UserRecordCache._copy(item) for item in value]
+        return value
+    
+    def get(self, kind, username, load):
+        """Return a copy of the cached (kind, username) record, calling load() on a miss"""
+        key = (kind, username)
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at >= self.external_check_seconds:
+                self._checked_at = now
+                file_state = self._read_file_state()
+                if file_state != self._file_state:
+                    self._entries.clear()
+                    self._file_state = file_state
+                    self.stats['invalidations'] += 1
+            if key in self._entries:
+                self.stats['hits'] += 1
+                return self._copy(self._entries[key])
+            self.stats['misses'] += 1
+            version = self.version
+        
+        value = load()
+        with self._lock:
+            # A write that landed while loading may not be in value, so don't keep it
+            if self.version == version:
+                self._entries[key] = value
+        return self._copy(value)
+    
+    def invalidate(self, username):
+        """Drop a user's records after this process wrote to them"""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == username]:
+                del self._entries[key]
+            # _file_state is left alone: the files may also hold another process's writes,
+            # which the next check must still notice
+            self.version += 1
+    
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / total if total else 0.0
+        return stats
+
+class UserStore:
+    """
+    SQLite database holding users and their histories, one connection per thread
+    
+    Streamlit serves each session from its own thread, so connections are
+    thread-local; WAL mode lets those readers run alongside a writer.
+    """
+    
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+        db = self.connection()
+        db.executescript(USER_DB_SCHEMA)
+        # Databases created before the event log have no event_seq column yet
+        if 'event_seq' not in {row['name'] for row in db.execute("PRAGMA table_info(users)")}:
+            with db:
+                db.execute("ALTER TABLE users ADD COLUMN event_seq INTEGER NOT NULL DEFAULT 0")
+        import_legacy_json_store(db)
+        self.records = UserRecordCache(self.path)
+    
+    def connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            self._local.db = db
+        return db
+
+@st.cache_resource
+def get_user_store():
+    """Process-wide user database, created (and migrated from users.json) on first use"""
+    return UserStore(USER_DB_PATH)
+
+def get_user_db():
+    """This thread's connection to the user database"""
+    return get_user_store().connection()
+
+def get_user_records():
+    return get_user_store().records
+
+def to_isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def parse_timestamp(value, default=None):
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            return default if default is not None else datetime.now()
+    return value
+
+def emotion_entry_to_row(entry):
+    embedding = entry.get('embedding')
+    return (
+        to_isoformat(entry.get('timestamp')),
+        entry.get('text'),
+        json.dumps(entry.get('emotions', []), default=str),
+        entry.get('risk_score', 0),
+        entry.get('source'),
+        np.asarray(embedding, dtype=np.float16).tobytes() if embedding is not None else None,
+        entry.get('embedding_model')
+    )
+
+def emotion_entry_from_row(row):
+    entry = {
+        'timestamp': parse_timestamp(row['timestamp']),
+        'text': row['text'],
+        'emotions': json.loads(row['emotions']),
+        'risk_score': row['risk_score']
+    }
+    if row['source'] is not None:
+        entry['source'] = row['source']
+    if row['embedding'] is not None:
+        entry['embedding'] = np.frombuffer(row['embedding'], dtype=np.float16)
+        entry['embedding_model'] = row['embedding_model']
+    return entry
+
+def chat_message_to_row(msg):
+    return (
+        msg['role'],
+        msg['content'],
+        to_isoformat(msg['timestamp']),
+        json.dumps(msg.get('emotions', []), default=str),
+        msg.get('risk_score', 0)
+    )
+
+def chat_message_from_row(row):
+    return {
+        'role': row['role'],
+        'content': row['content'],
+        'timestamp': parse_timestamp(row['timestamp']),
+        'emotions': json.loads(row['emotions']),
+        'risk_score': row['risk_score']
+    }
+
+def dass_result_to_row(result):
+    return (
+        result.get('timestamp'),
+        json.dumps(result.get('scores', {})),
+        json.dumps(result.get('severity', {})),
+        result.get('completion_percentage')
+    )
+
+def dass_result_from_row(row):
+    return {
+        'timestamp': row['timestamp'],
+        'scores': json.loads(row['scores']),
+        'severity': json.loads(row['severity']),
+        'completion_percentage': row['completion_percentage']
+    }
+
+def insert_user_rows(db, table, columns, username, rows):
+    placeholders = ', '.join('?' * (len(columns) + 1))
+    db.executemany(
+        f"INSERT INTO {table} (username, {', '.join(columns)}) VALUES ({placeholders})",
+        [(username,) + tuple(row) for row in rows]
+    )
+
+def import_legacy_json_store(db):
+    """One-time import of users.json and gratitude.json into an empty database"""
+    if LEGACY_USERS_FILE.exists() and db.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        try:
+            with open(LEGACY_USERS_FILE, 'r') as f:
+                users = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("Could not import %s: %s", LEGACY_USERS_FILE, e)
+            users = {}
+        
+        with db:
+            for username, user_data in users.items():
+                db.execute(
+                    "INSERT INTO users (username, password, email, registered_date, last_login, dass_completed, "
+                    "analysis_count, last_analysis_time, social_media_results, streak_count, longest_streak, last_checkin_date) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        username, user_data.get('password'), user_data.get('email'),
+                        user_data.get('registered_date'), user_data.get('last_login'),
+                        int(bool(user_data.get('dass_completed', False))), user_data.get('analysis_count', 0),
+                        user_data.get('last_analysis_time'), json.dumps(user_data.get('social_media_results'), default=str),
+                        user_data.get('streak_count', 0), user_data.get('longest_streak', 0), user_data.get('last_checkin_date')
+                    )
+                )
+                emotion_history = [
+                    dict(entry, embedding=decode_embedding(entry['embedding'])) if isinstance(entry.get('embedding'), str) else entry
+                    for entry in user_data.get('emotion_history', [])
+                ]
+                insert_user_rows(db, 'emotion_entries', EMOTION_ENTRY_COLUMNS, username, map(emotion_entry_to_row, emotion_history))
+                insert_user_rows(db, 'chat_messages', CHAT_MESSAGE_COLUMNS, username, map(chat_message_to_row, user_data.get('chat_history', [])))
+                insert_user_rows(db, 'dass_results', DASS_RESULT_COLUMNS, username, map(dass_result_to_row, user_data.get('dass_history', [])))
+                if 'mind_gym' in user_data:
+                    mind_gym_data = user_data['mind_gym']
+                    db.execute(
+                        "INSERT INTO mind_gym (username, xp, level, completed_tasks) VALUES (?, ?, ?, ?)",
+                        (username, mind_gym_data.get('xp', 0), mind_gym_data.get('level', 1), json.dumps(mind_gym_data.get('completed_tasks', [])))
+                    )
+        logger.info("Imported %d users from %s into %s", len(users), LEGACY_USERS_FILE, USER_DB_PATH)
+    
+    if LEGACY_GRATITUDE_FILE.exists() and db.execute("SELECT COUNT(*) FROM gratitude_entries").fetchone()[0] == 0:
+        try:
+            with open(LEGACY_GRATITUDE_FILE, 'r') as f:
+                all_entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            all_entries = {}
+        with db:
+            for username, entries in all_entries.items():
+                insert_user_rows(db, 'gratitude_entries', ('entry', 'timestamp'), username, ((e['entry'], e['timestamp']) for e in entries))
+
+def emotion_entry_to_json(entry):
+    entry_copy = entry.copy()
+    entry_copy['timestamp'] = to_isoformat(entry_copy.get('timestamp'))
+    if entry_copy.get('embedding') is not None:
+        entry_copy['embedding'] = encode_embedding(entry_copy['embedding'])
+    return entry_copy
+
+def emotion_entry_from_json(data):
+    entry = data.copy()
+    entry['timestamp'] = parse_timestamp(entry.get('timestamp'))
+    if isinstance(entry.get('embedding'), str):
+        entry['embedding'] = decode_embedding(entry['embedding'])
+    return entry
+
+def chat_message_to_json(msg):
+    return {
+        'role': msg['role'],
+        'content': msg['content'],
+        'timestamp': to_isoformat(msg['timestamp']),
+        'emotions': msg.get('emotions', []),
+        'risk_score': msg.get('risk_score', 0)
+    }
+
+def chat_message_from_json(data):
+    return dict(data, timestamp=parse_timestamp(data.get('timestamp')))
+
+class InterProcessLock:
+    """Re-entrant lock across this process's threads and, via flock on lock_path, other processes"""
+    
+    def __init__(self, lock_path):
+        self.lock_path = Path(lock_path)
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+    
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._file = open(self.lock_path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+class UserEventLog:
+    """
+    Append-only per-user JSON Lines log of history writes, periodically folded into the database
+    
+    Appends, compaction and snapshot+log reads all hold the lock file in log_dir.
+    """
+    
+    def __init__(self, log_dir, store, compact_seconds=USER_EVENT_COMPACT_SECONDS):
+        self.log_dir = Path(log_dir)
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.store = store
+        self.compact_seconds = compact_seconds
+        self.lock = InterProcessLock(self.log_dir / ".lock")
+        self.stats = {'appended': 0, 'compactions': 0, 'compacted_events': 0}
+        self._thread = threading.Thread(target=self._run, name="user-event-compactor", daemon=True)
+        self._thread.start()
+    
+    def _path(self, username):
+        return self.log_dir / f"{urllib.parse.quote(username, safe='')}.jsonl"
+    
+    def read(self, username):
+        """Events in the user's log; a torn last line from a crash mid-append is ignored"""
+        events = []
+        with self.lock:
+            try:
+                with open(self._path(username), 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            events.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            break
+            except FileNotFoundError:
+                pass
+        return events
+    
+    def _last_logged_seq(self, username):
+        """
+        Sequence number of the last complete event in the user's log, or 0
+        
+        Reads the log backwards only as far as its last line, and cuts a
+        partial last line left by a crash so new events don't get glued onto it.
+        """
+        try:
+            with open(self._path(username), 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                start = size
+                tail = b""
+                while start > 0 and tail.count(b"\n") < 2:
+                    start = max(start - 4096, 0)
+                    f.seek(start)
+                    tail = f.read(size - start)
+                complete = tail[:tail.rfind(b"\n") + 1]
+                if len(complete) < len(tail):
+                    f.truncate(start + len(complete))
+        except FileNotFoundError:
+            return 0
+        lines = complete.splitlines()
+        return json.loads(lines[-1])['seq'] if lines else 0
+    
+    def append(self, username, events):
+        """Durably append (event_type, data) pairs to the user's log"""
+        if not events:
+            return
+        with self.lock:
+            stored = self.store.connection().execute(
+                "SELECT event_seq FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            seq = max(stored['event_seq'] if stored else 0, self._last_logged_seq(username)) + 1
+            
+            lines = []
+            for event_type, data in events:
+                lines.append(json.dumps({'seq': seq, 'type': event_type, 'data': data}, default=str) + "\n")
+                seq += 1
+            with open(self._path(username), 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self.stats['appended'] += len(events)
+    
+    def compact(self, username):
+        """Fold the user's logged events into the database and truncate the log"""
+        with self.lock:
+            events = self.read(username)
+            if not events:
+                return 0
+            
+            db = self.store.connection()
+            with db:
+                stored = db.execute("SELECT event_seq FROM users WHERE username = ?", (username,)).fetchone()
+                if stored is None:
+                    # Keep the events rather than dropping them; they apply once the user row exists
+                    logger.warning("Not compacting the event log of %s: no such user in the database", username)
+                    return 0
+                pending = [event for event in events if event['seq'] > stored['event_seq']]
+                for event in pending:
+                    apply_user_event(db, username, event)
+                db.execute("UPDATE users SET event_seq = ? WHERE username = ?", (events[-1]['seq'], username))
+            self.store.records.invalidate(username)
+            self._path(username).unlink()
+            self.stats['compactions'] += 1
+            self.stats['compacted_events'] += len(events)
+            return len(events)
+    
+    def compact_all(self):
+        for path in self.log_dir.glob("*.jsonl"):
+            username = urllib.parse.unquote(path.stem)
+            try:
+                self.compact(username)
+            except (OSError, sqlite3.Error):
+                logger.exception("Compacting the event log of %s failed", username)
+    
+    def _run(self):
+        while True:
+            # Also picks up logs left behind by a previous process
+            self.compact_all()
+            time.sleep(self.compact_seconds)
+
+@st.cache_resource
+def get_user_event_log():
+    """Process-wide event log writing to USER_EVENT_LOG_DIR"""
+    return UserEventLog(USER_EVENT_LOG_DIR, get_user_store())
+
+def apply_user_event(db, username, event):
+    """Apply one logged event to the database; caller owns the transaction"""
+    data = event['data']
+    if event['type'] == 'emotion_entry':
+        insert_user_rows(db, 'emotion_entries', EMOTION_ENTRY_COLUMNS, username, [emotion_entry_to_row(emotion_entry_from_json(data))])
+    elif event['type'] == 'chat_message':
+        insert_user_rows(db, 'chat_messages', CHAT_MESSAGE_COLUMNS, username, [chat_message_to_row(data)])
+    elif event['type'] == 'dass_result':
+        insert_user_rows(db, 'dass_results', DASS_RESULT_COLUMNS, username, [dass_result_to_row(data)])
+    elif event['type'] == 'clear_history':
+        db.execute("DELETE FROM emotion_entries WHERE username = ?", (username,))
+        db.execute("DELETE FROM chat_messages WHERE username = ?", (username,))
+    elif event['type'] == 'clear_chat':
+        db.execute("DELETE FROM chat_messages WHERE username = ?", (username,))
+
+def load_user_histories(username, kinds=('emotion_history', 'chat_history', 'dass_history')):
+    """
+    A user's histories as stored in the database plus the not yet compacted log tail
+    
+    Holds the event log lock so a concurrent compaction, in this or another
+    process, can't move events between the two reads.
+    """
+    event_log = get_user_event_log()
+    db = get_user_db()
+    histories = {}
+    with event_log.lock:
+        stored = db.execute("SELECT event_seq FROM users WHERE username = ?", (username,)).fetchone()
+        if stored is None:
+            return None
+        if 'emotion_history' in kinds:
+            histories['emotion_history'] = [
+                emotion_entry_from_row(row)
+                for row in db.execute("SELECT * FROM emotion_entries WHERE username = ? ORDER BY id", (username,))
+            ]
+        if 'chat_history' in kinds:
+            histories['chat_history'] = [
+                chat_message_from_row(row)
+                for row in db.execute("SELECT * FROM chat_messages WHERE username = ? ORDER BY id", (username,))
+            ]
+        if 'dass_history' in kinds:
+            histories['dass_history'] = [
+                dass_result_from_row(row)
+                for row in db.execute("SELECT * FROM dass_results WHERE username = ? ORDER BY id", (username,))
+            ]
+        events = [event for event in event_log.read(username) if event['seq'] > stored['event_seq']]
+    
+    replay = {
+        'emotion_entry': ('emotion_history', emotion_entry_from_json),
+        'chat_message': ('chat_history', chat_message_from_json),
+        'dass_result': ('dass_history', dict)
+    }
+    for event in events:
+        if event['type'] in ('clear_history', 'clear_chat'):
+            cleared = ('chat_history',) if event['type'] == 'clear_chat' else ('emotion_history', 'chat_history')
+            for kind in cleared:
+                if kind in histories:
+                    histories[kind] = []
+        elif replay[event['type']][0] in histories:
+            kind, from_json = replay[event['type']]
+            histories[kind].append(from_json(event['data']))
+    return histories
+
 # Authentication Functions
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
-def load_users():
-    """Load users with error handling for corrupted JSON"""
-    users_file = Path("users.json")
-    if users_file.exists():
-        try:
-            with open(users_file, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError as e:
-            # If JSON is corrupted, backup the file and start fresh
-            st.error(f" users.json was corrupted. Creating backup and starting fresh.")
-            backup_file = Path(f"users_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
-            users_file.rename(backup_file)
-            return {}
-        except Exception as e:
-            st.error(f"Error loading users: {str(e)}")
-            return {}
-    return {}
-
+def load_user_row(username):
+    """The user's profile row as a dict, or None; served from the record cache"""
+    def load():
+        row = get_user_db().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row is not None else None
+    return get_user_records().get('user', username, load)
 
-def save_users(users):
-    """Save users with proper JSON serialization"""
-    try:
-        with open("users.json", 'w') as f:
-            json.dump(users, f, indent=2, default=str)  # default=str handles datetime objects
-    except Exception as e:
-        st.error(f"Error saving users: {str(e)}")
+def user_exists(username):
+    return load_user_row(username) is not None
 
 def register_user(username, password, email):
-    users = load_users()
-    if username in users:
+    db = get_user_db()
+    try:
+        with db:
+            db.execute(
+                "INSERT INTO users (username, password, email, registered_date, last_analysis_time) VALUES (?, ?, ?, ?, ?)",
+                (username, hash_password(password), email, datetime.now().isoformat(), (datetime.now() - timedelta(hours=5)).isoformat())
+            )
+    except sqlite3.IntegrityError:
         return False, "Username already exists"
-    
-    users[username] = {
-        'password': hash_password(password),
-        'email': email,
-        'registered_date': datetime.now().isoformat(),
-        'last_login': None,
-        'dass_completed': False,
-        'dass_history': [],
-        'emotion_history': [],
-        'chat_history': [],
-        'analysis_count': 0,
-        'last_analysis_time': (datetime.now() - timedelta(hours=5)).isoformat(),
-        'social_media_results': None
-    }
-    save_users(users)
+    get_user_records().invalidate(username)
     return True, "Registration successful"
 
 
 def login_user(username, password):
-    users = load_users()
-    if username not in users:
+    row = load_user_row(username)
+    if row is None:
         return False, "Username not found", False
     
-    if users[username]['password'] == hash_password(password):
-        users[username]['last_login'] = datetime.now().isoformat()
-        save_users(users)
-        dass_completed = users[username].get('dass_completed', False)
+    if row['password'] == hash_password(password):
+        db = get_user_db()
+        with db:
+            db.execute("UPDATE users SET last_login = ? WHERE username = ?", (datetime.now().isoformat(), username))
+        get_user_records().invalidate(username)
+        dass_completed = bool(row['dass_completed'])
         
         #  LOAD USER'S SAVED HISTORY - This is the key addition!
         load_user_session_data(username)
@@ -667,122 +1336,474 @@ def login_user(username, password):
         return True, "Login successful", dass_completed
     return False, "Incorrect password", False
 
-def save_user_session_data(username):
-    """Save all session data for a user to their profile with proper serialization"""
-    users = load_users()
-    if username in users:
-        # Serialize emotion history
-        emotion_history_serialized = []
-        for entry in st.session_state.emotion_history:
-            entry_copy = entry.copy()
-            # Convert datetime to string
-            if isinstance(entry_copy.get('timestamp'), datetime):
-                entry_copy['timestamp'] = entry_copy['timestamp'].isoformat()
-            emotion_history_serialized.append(entry_copy)
-        
-        # Serialize chat history
-        chat_history_serialized = []
-        for msg in st.session_state.chat_history:
-            msg_copy = {
-                'role': msg['role'],
-                'content': msg['content'],
-                'timestamp': msg['timestamp'].isoformat() if isinstance(msg['timestamp'], datetime) else msg['timestamp'],
-                'emotions': msg.get('emotions', []),
-                'risk_score': msg.get('risk_score', 0)
-            }
-            chat_history_serialized.append(msg_copy)
-        
-        last_analysis_time = st.session_state.last_analysis_time
-        if isinstance(last_analysis_time, datetime):
-            last_analysis_time = last_analysis_time.isoformat()
-        
-        # Update user data
-        users[username]['emotion_history'] = emotion_history_serialized
-        users[username]['chat_history'] = chat_history_serialized
-        users[username]['analysis_count'] = st.session_state.analysis_count
-        users[username]['last_analysis_time'] = last_analysis_time
-        users[username]['social_media_results'] = st.session_state.social_media_results
-        
-        save_users(users)
+def snapshot_session():
+    """
+    What the persisted session fields looked like at the last save
+    
+    Histories are remembered by identity and length: they are only ever
+    appended to, or replaced wholesale when cleared, so that is enough to
+    tell what changed without comparing entries.
+    """
+    return {
+        'emotion_history': (st.session_state.emotion_history, len(st.session_state.emotion_history)),
+        'chat_history': (st.session_state.chat_history, len(st.session_state.chat_history)),
+        'analysis_count': st.session_state.analysis_count,
+        'last_analysis_time': st.session_state.last_analysis_time,
+        'social_media_results': st.session_state.social_media_results
+    }
+
+def get_dirty_fields(saved):
+    """Names of the persisted session fields that changed since the saved snapshot"""
+    dirty = set()
+    for field in ('emotion_history', 'chat_history'):
+        saved_items, saved_length = saved.get(field, (None, 0))
+        if st.session_state[field] is not saved_items or len(st.session_state[field]) != saved_length:
+            dirty.add(field)
+    for field in ('analysis_count', 'last_analysis_time'):
+        if field not in saved or st.session_state[field] != saved[field]:
+            dirty.add(field)
+    if st.session_state.social_media_results is not saved.get('social_media_results'):
+        dirty.add('social_media_results')
+    return dirty
+
+def collect_session_changes(dirty, saved):
+    """Column updates and history events that bring the stored profile up to the session"""
+    columns = {}
+    if 'analysis_count' in dirty:
+        columns['analysis_count'] = st.session_state.analysis_count
+    if 'last_analysis_time' in dirty:
+        columns['last_analysis_time'] = to_isoformat(st.session_state.last_analysis_time)
+    if 'social_media_results' in dirty:
+        columns['social_media_results'] = json.dumps(st.session_state.social_media_results, default=str)
+    
+    histories = ('emotion_history', 'chat_history')
+    replaced = {
+        field: st.session_state[field] is not saved.get(field, (None, 0))[0] or len(st.session_state[field]) < saved[field][1]
+        for field in histories
+    }
+    # A replaced history (e.g. cleared) is logged as a clear followed by whatever the session now holds.
+    # Only the chat can be cleared on its own; a replaced emotion history clears and re-logs both.
+    if replaced['emotion_history']:
+        events = [('clear_history', {})]
+        starts = {field: 0 for field in histories}
+    elif replaced['chat_history']:
+        events = [('clear_chat', {})]
+        starts = {'emotion_history': saved['emotion_history'][1], 'chat_history': 0}
+    else:
+        events = []
+        starts = {field: saved[field][1] for field in histories}
+    events += [('emotion_entry', emotion_entry_to_json(entry)) for entry in st.session_state.emotion_history[starts['emotion_history']:]]
+    events += [('chat_message', chat_message_to_json(msg)) for msg in st.session_state.chat_history[starts['chat_history']:]]
+    return {'columns': columns, 'events': events}
+
+def write_session_changes(store, event_log, username, changes):
+    """Apply collected session changes: one UPDATE of the changed columns and one log append"""
+    columns = changes['columns']
+    db = store.connection()
+    if columns:
+        with db:
+            updated = db.execute(
+                f"UPDATE users SET {', '.join(f'{column} = ?' for column in columns)} WHERE username = ?",
+                tuple(columns.values()) + (username,)
+            ).rowcount
+        store.records.invalidate(username)
+    else:
+        updated = db.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+    if updated:
+        event_log.append(username, changes['events'])
+
+class SessionAutosaver:
+    """
+    Debounced writer of session changes
+    
+    The first change for a user starts a AUTOSAVE_DEBOUNCE_SECONDS timer and
+    every change submitted before it fires is merged into the same pending
+    write, so a burst of reruns costs one UPDATE and one log append. The
+    timers are non-daemon threads, so pending writes still happen when the
+    process exits.
+    """
+    
+    def __init__(self, store, event_log, debounce_seconds=AUTOSAVE_DEBOUNCE_SECONDS):
+        # Passed in rather than looked up, since the timers run outside any script run
+        self.store = store
+        self.event_log = event_log
+        self.debounce_seconds = debounce_seconds
+        self._pending = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+        # Serializes writes so a user's events are appended in the order they were collected
+        self._write_lock = threading.Lock()
+        self.stats = {'skipped': 0, 'coalesced': 0, 'performed': 0, 'failed': 0}
+    
+    @staticmethod
+    def _merge(older, newer):
+        return {
+            'columns': {**older['columns'], **newer['columns']},
+            'events': older['events'] + newer['events']
+        }
+    
+    def skip(self):
+        with self._lock:
+            self.stats['skipped'] += 1
+    
+    def submit(self, username, changes, immediate=False):
+        with self._lock:
+            if username in self._pending:
+                self._pending[username] = self._merge(self._pending[username], changes)
+                self.stats['coalesced'] += 1
+            else:
+                self._pending[username] = changes
+            if not immediate and username not in self._timers:
+                timer = threading.Timer(self.debounce_seconds, self.flush, args=(username,))
+                self._timers[username] = timer
+                timer.start()
+        if immediate:
+            return self.flush(username)
+        return True
+    
+    def flush(self, username):
+        """Write the user's pending changes now; returns False if the write failed"""
+        with self._write_lock:
+            with self._lock:
+                timer = self._timers.pop(username, None)
+                changes = self._pending.pop(username, None)
+            if timer is not None:
+                timer.cancel()
+            if changes is None:
+                return True
+            
+            try:
+                write_session_changes(self.store, self.event_log, username, changes)
+            except (sqlite3.Error, OSError):
+                logger.exception("Saving the session of %s failed; will retry", username)
+                with self._lock:
+                    self.stats['failed'] += 1
+                    self._pending[username] = self._merge(changes, self._pending.get(username, {'columns': {}, 'events': []}))
+                    if username not in self._timers:
+                        timer = threading.Timer(self.debounce_seconds, self.flush, args=(username,))
+                        self._timers[username] = timer
+                        timer.start()
+                return False
+            
+            with self._lock:
+                self.stats['performed'] += 1
+            logger.debug("Saved session of %s (%s)", username, self.stats)
+            return True
+    
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+@st.cache_resource
+def get_session_autosaver():
+    """Process-wide debounced session writer"""
+    return SessionAutosaver(get_user_store(), get_user_event_log())
+
+def save_user_session_data(username, immediate=True):
+    """
+    Persist the session fields that changed since the last save
+    
+    With immediate=False (the per-rerun autosave) the write is debounced;
+    otherwise it happens now, together with anything still pending.
+    """
+    saved = st.session_state.get('saved_session', {})
+    dirty = get_dirty_fields(saved)
+    autosaver = get_session_autosaver()
+    
+    if not dirty:
+        if immediate:
+            autosaver.flush(username)
+        else:
+            autosaver.skip()
+        return
+    
+    changes = collect_session_changes(dirty, saved)
+    st.session_state.saved_session = snapshot_session()
+    if not autosaver.submit(username, changes, immediate):
+        st.error("Error saving user data; it will be retried shortly.")
 
 def load_user_session_data(username):
     """Load session data for a user from their profile"""
-    users = load_users()
-    if username in users:
-        user_data = users[username]
-        
-        # Load emotion history
-        st.session_state.emotion_history = user_data.get('emotion_history', [])
-        # Convert timestamp strings back to datetime objects
-        for entry in st.session_state.emotion_history:
-            if isinstance(entry.get('timestamp'), str):
-                try:
-                    entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
-                except:
-                    entry['timestamp'] = datetime.now()
-        
-        # Load chat history
-        chat_history = user_data.get('chat_history', [])
-        st.session_state.chat_history = []
-        for msg in chat_history:
-            msg_copy = msg.copy()
-            if isinstance(msg_copy.get('timestamp'), str):
-                try:
-                    msg_copy['timestamp'] = datetime.fromisoformat(msg_copy['timestamp'])
-                except:
-                    msg_copy['timestamp'] = datetime.now()
-            st.session_state.chat_history.append(msg_copy)
+    user_row = load_user_row(username)
+    if user_row is None:
+        return
+    
+    histories = load_user_histories(username, ('emotion_history', 'chat_history'))
+    st.session_state.emotion_history = histories['emotion_history']
+    st.session_state.chat_history = histories['chat_history']
+    
+    st.session_state.analysis_count = user_row['analysis_count']
+    st.session_state.last_analysis_time = parse_timestamp(
+        user_row['last_analysis_time'], datetime.now() - timedelta(hours=5)
+    ) or datetime.now() - timedelta(hours=5)
+    st.session_state.social_media_results = json.loads(user_row['social_media_results']) if user_row['social_media_results'] else None
+    st.session_state.saved_session = snapshot_session()
+
+def load_dass_history(username):
+    """A user's DASS-42 results, oldest first"""
+    histories = load_user_histories(username, ('dass_history',))
+    return histories['dass_history'] if histories else []
+
+def add_dass_result(username, result):
+    """Record a submitted DASS-42 questionnaire and mark the user's assessment complete"""
+    db = get_user_db()
+    with db:
+        updated = db.execute("UPDATE users SET dass_completed = 1 WHERE username = ?", (username,)).rowcount
+    get_user_records().invalidate(username)
+    if updated:
+        get_user_event_log().append(username, [('dass_result', result)])
+
+def load_user_profile(username):
+    """
+    Everything stored for a user as one dict in the old users.json layout, or None
+    
+    Used for full reports; pages that need one field should query it directly.
+    """
+    user_data = load_user_row(username)
+    if user_data is None:
+        return None
+    
+    del user_data['event_seq']
+    user_data['dass_completed'] = bool(user_data['dass_completed'])
+    user_data['social_media_results'] = json.loads(user_data['social_media_results']) if user_data['social_media_results'] else None
+    histories = load_user_histories(username) or {'emotion_history': [], 'chat_history': [], 'dass_history': []}
+    user_data['dass_history'] = histories['dass_history']
+    user_data['emotion_history'] = [dict(entry, timestamp=to_isoformat(entry['timestamp'])) for entry in histories['emotion_history']]
+    user_data['chat_history'] = [dict(msg, timestamp=to_isoformat(msg['timestamp'])) for msg in histories['chat_history']]
+    
+    mind_gym_data = load_mind_gym(username)
+    if mind_gym_data is not None:
+        user_data['mind_gym'] = mind_gym_data
+    return user_data
+
+# ======================
+# WRITE-BEHIND PERSISTENCE
+# ======================
+class WriteBehindQueue:
+    """
+    Background writer that merges persistence intents per record key and flushes them in batches
+    
+    The lock only guards the pending and in-flight dicts; writes run without it.
+    """
+    
+    def __init__(self, store, flush_seconds=WRITE_BEHIND_FLUSH_SECONDS, max_pending=WRITE_BEHIND_MAX_PENDING):
+        self.store = store
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self._lock = threading.RLock()
+        # Notified when a flush finishes, for readers waiting on records it was writing
+        self._flushed = threading.Condition(self._lock)
+        # Serializes flushes between the background thread and close()
+        self._write_lock = threading.Lock()
+        self._pending = {}
+        self._in_flight = {}
+        self._generation = 0
+        self._wake = threading.Event()
+        self._closed = False
+        self.stats = {'intents': 0, 'coalesced': 0, 'flushes': 0, 'records_written': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def submit(self, key, value, merge, write, uses_db=True):
+        """
+        Queue write(db, key, value) for the record key
         
-        # Load other session data
-        st.session_state.analysis_count = user_data.get('analysis_count', 0)
+        merge(pending_value, value) combines it with an intent that is still
+        waiting. File-backed intents pass uses_db=False and get db=None.
+        """
+        with self._lock:
+            self.stats['intents'] += 1
+            if key in self._pending:
+                pending_value, _, _, _ = self._pending[key]
+                value = merge(pending_value, value)
+                self.stats['coalesced'] += 1
+            self._pending[key] = (value, merge, write, uses_db)
+            pending_count = len(self._pending)
+        if pending_count >= self.max_pending or self._closed:
+            self._wake.set()
+    
+    def overlay(self, keys, load):
+        """
+        Return (load(), {key: pending value}) as one consistent view
         
-        last_analysis = user_data.get('last_analysis_time')
-        if last_analysis:
+        load() runs outside the lock. If a flush took pending records while it
+        ran, the written data may or may not be in what was loaded, so the read
+        is retried; a reader only waits while its own keys are being written.
+        """
+        while True:
+            with self._lock:
+                while any(key in self._in_flight for key in keys):
+                    self._flushed.wait()
+                generation = self._generation
+                pending = {key: copy.deepcopy(self._pending[key][0]) for key in keys if key in self._pending}
+            loaded = load()
+            with self._lock:
+                if self._generation == generation:
+                    return loaded, pending
+    
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                if not pending:
+                    return
+                self._in_flight = pending
+                self._generation += 1
+            
+            written = set()
             try:
-                st.session_state.last_analysis_time = datetime.fromisoformat(last_analysis) if isinstance(last_analysis, str) else last_analysis
-            except:
-                st.session_state.last_analysis_time = datetime.now() - timedelta(hours=5)
-        else:
-            st.session_state.last_analysis_time = datetime.now() - timedelta(hours=5)
-        
-        st.session_state.social_media_results = user_data.get('social_media_results', None)
+                db_intents = {key: intent for key, intent in pending.items() if intent[3]}
+                if db_intents:
+                    db = self.store.connection()
+                    db.execute("PRAGMA synchronous=FULL")
+                    try:
+                        with db:
+                            for key, (value, _, write, _) in db_intents.items():
+                                write(db, key, value)
+                        written.update(db_intents)
+                    except sqlite3.Error:
+                        logger.exception("Write-behind flush of %d records failed; will retry", len(db_intents))
+                for key, intent in pending.items():
+                    if not intent[3]:
+                        try:
+                            intent[2](None, key, intent[0])
+                            written.add(key)
+                        except (OSError, ValueError):
+                            logger.exception("Write-behind flush of %s failed; will retry", key)
+            finally:
+                with self._lock:
+                    # Records that weren't written go back in the queue, ahead of anything submitted since
+                    failed = {key: intent for key, intent in pending.items() if key not in written}
+                    for key, (value, merge, write, uses_db) in failed.items():
+                        if key in self._pending:
+                            value = merge(value, self._pending[key][0])
+                        self._pending[key] = (value, merge, write, uses_db)
+                    for key in written:
+                        if len(key) > 1:
+                            self.store.records.invalidate(key[1])
+                    self._in_flight = {}
+                    self._flushed.notify_all()
+                    self.stats['flushes'] += 1
+                    self.stats['records_written'] += len(written)
+                    self.stats['failed'] += len(failed)
+    
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+    
+    def close(self):
+        """Flush everything durably; called at interpreter exit"""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+    
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, pending=len(self._pending))
+
+@st.cache_resource
+def get_write_behind_queue():
+    """Process-wide write-behind queue for the user store and community posts"""
+    return WriteBehindQueue(get_user_store())
+
+def merge_sum(pending, value):
+    return pending + value
+
+def merge_replace(pending, value):
+    return value
+
+def write_file_durably(path, content):
+    """Replace path with content so that a crash leaves either the old or the new file"""
+    temp_path = path.with_name(f"{path.name}.tmp")
+    with open(temp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
 
 # ======================
 # COMMUNITY POSTS HELPERS
 # ======================
-def load_community_posts():
-    """Load community posts with error handling"""
-    posts_file = Path("community_posts.json")
-    if posts_file.exists():
-        try:
-            with open(posts_file, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            st.error(" Community posts file was corrupted. Starting fresh.")
-            return []
-        except Exception as e:
-            st.error(f"Error loading posts: {str(e)}")
-            return []
-    return []
+def read_community_posts_file():
+    """
+    Community posts as stored on disk, [] if there is no file yet
+    
+    Raises OSError or ValueError if the file can't be read, so the
+    write-behind queue retries instead of overwriting everyone's posts.
+    """
+    if not COMMUNITY_POSTS_FILE.exists():
+        return []
+    with open(COMMUNITY_POSTS_FILE, 'r') as f:
+        return json.load(f)
+
+def apply_community_changes(posts, changes):
+    """A new posts list with pending community changes (new posts, reaction counts) applied; inputs are left untouched"""
+    posts = posts + changes.get('new_posts', [])
+    for reaction_key, count in changes.get('reactions', {}).items():
+        post_idx, emoji = reaction_key.split("\0")
+        if int(post_idx) < len(posts):
+            post = dict(posts[int(post_idx)])
+            post['reactions'] = dict(post['reactions'])
+            post['reactions'][emoji] = post['reactions'].get(emoji, 0) + count
+            posts[int(post_idx)] = post
+    return posts
+
+def merge_community_changes(pending, changes):
+    reactions = dict(pending.get('reactions', {}))
+    for reaction_key, count in changes.get('reactions', {}).items():
+        reactions[reaction_key] = reactions.get(reaction_key, 0) + count
+    return {
+        'new_posts': pending.get('new_posts', []) + changes.get('new_posts', []),
+        'reactions': reactions
+    }
+
+def write_community_changes(db, key, changes):
+    posts = apply_community_changes(read_community_posts_file(), changes)
+    write_file_durably(COMMUNITY_POSTS_FILE, json.dumps(posts, indent=2, default=str))
 
-def save_community_posts(posts):
-    """Save community posts safely"""
+def submit_community_changes(changes):
+    get_write_behind_queue().submit(
+        ('community_posts',), changes, merge_community_changes, write_community_changes, uses_db=False
+    )
+
+def load_community_posts():
+    """Community posts as stored plus any changes still waiting to be written"""
     try:
-        with open("community_posts.json", 'w') as f:
-            json.dump(posts, f, indent=2, default=str)
+        posts, pending = get_write_behind_queue().overlay([('community_posts',)], read_community_posts_file)
+    except json.JSONDecodeError:
+        st.error(" Community posts file is corrupted. New posts and reactions are kept until it is repaired.")
+        return []
     except Exception as e:
-        st.error(f"Error saving posts: {str(e)}")
+        st.error(f"Error loading posts: {str(e)}")
+        return []
+    if pending:
+        posts = apply_community_changes(posts, pending[('community_posts',)])
+    return posts
+
+def add_community_post(entry):
+    submit_community_changes({'new_posts': [entry]})
+
+def add_community_reaction(post_idx, emoji):
+    """Count one reaction; concurrent reactions from other sessions add up instead of overwriting"""
+    submit_community_changes({'reactions': {f"{post_idx}\0{emoji}": 1}})
 
 # ======================
 # STREAK & XP HELPERS
 # ======================
+def get_streak(username):
+    """(streak_count, longest_streak) for a user, or None if the user doesn't exist"""
+    row = load_user_row(username)
+    return (row['streak_count'], row['longest_streak']) if row else None
+
 def update_streak(username):
     """Update user's streak based on last check-in date"""
-    users = load_users()
-    if username not in users:
+    user_data = load_user_row(username)
+    if user_data is None:
         return
     
-    user_data = users[username]
     today = datetime.now().date()
     
     last_checkin_str = user_data.get('last_checkin_date')
@@ -795,180 +1816,2109 @@ def update_streak(username):
     else:
         last_checkin = None
     
-    if last_checkin is None:
-        # First check-in
-        user_data['streak_count'] = 1
-        user_data['longest_streak'] = 1
-        user_data['last_checkin_date'] = today.isoformat()
-    elif last_checkin == today:
-        # Same day - no change
-        pass
-    elif (today - last_checkin).days == 1:
-        # Next day - increment streak
-        user_data['streak_count'] = user_data.get('streak_count', 0) + 1
-        user_data['longest_streak'] = max(
-            user_data.get('longest_streak', 0),
-            user_data['streak_count']
+    if last_checkin is None:
+        # First check-in
+        user_data['streak_count'] = 1
+        user_data['longest_streak'] = 1
+        user_data['last_checkin_date'] = today.isoformat()
+    elif last_checkin == today:
+        # Same day - no change
+        return
+    elif (today - last_checkin).days == 1:
+        # Next day - increment streak
+        user_data['streak_count'] = user_data.get('streak_count', 0) + 1
+        user_data['longest_streak'] = max(
+            user_data.get('longest_streak', 0),
+            user_data['streak_count']
+        )
+        user_data['last_checkin_date'] = today.isoformat()
+    else:
+        # Missed a day - reset to 1
+        user_data['streak_count'] = 1
+        user_data['last_checkin_date'] = today.isoformat()
+    
+    db = get_user_db()
+    with db:
+        db.execute(
+            "UPDATE users SET streak_count = ?, longest_streak = ?, last_checkin_date = ? WHERE username = ?",
+            (user_data['streak_count'], user_data['longest_streak'], user_data['last_checkin_date'], username)
+        )
+    get_user_records().invalidate(username)
+
+def load_mind_gym(username):
+    """A user's Mind Gym progress including pending XP and tasks, or None if they haven't started"""
+    def load():
+        row = get_user_db().execute("SELECT xp, level, completed_tasks FROM mind_gym WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        return {'xp': row['xp'], 'level': row['level'], 'completed_tasks': json.loads(row['completed_tasks'])}
+    
+    xp_key, tasks_key = ('xp', username), ('completed_tasks', username)
+    mind_gym_data, pending = get_write_behind_queue().overlay(
+        [xp_key, tasks_key], lambda: get_user_records().get('mind_gym', username, load)
+    )
+    if pending:
+        mind_gym_data = mind_gym_data or {'xp': 0, 'level': 1, 'completed_tasks': []}
+        mind_gym_data['xp'] += pending.get(xp_key, 0)
+        mind_gym_data['level'] = (mind_gym_data['xp'] // 100) + 1
+        mind_gym_data['completed_tasks'] = pending.get(tasks_key, mind_gym_data['completed_tasks'])
+    return mind_gym_data
+
+def write_completed_tasks(db, key, completed_tasks):
+    db.execute(
+        "INSERT INTO mind_gym (username, completed_tasks) VALUES (?, ?) "
+        "ON CONFLICT (username) DO UPDATE SET completed_tasks = excluded.completed_tasks",
+        (key[1], json.dumps(completed_tasks))
+    )
+
+def save_completed_tasks(username, completed_tasks):
+    get_write_behind_queue().submit(('completed_tasks', username), list(completed_tasks), merge_replace, write_completed_tasks)
+
+def write_xp(db, key, amount):
+    # Level up every 100 XP
+    db.execute(
+        "INSERT INTO mind_gym (username, xp, level) VALUES (?, ?, ? / 100 + 1) "
+        "ON CONFLICT (username) DO UPDATE SET xp = xp + excluded.xp, level = (xp + excluded.xp) / 100 + 1",
+        (key[1], amount, amount)
+    )
+
+def add_xp(username, amount):
+    """Add XP and level up user"""
+    if not user_exists(username):
+        return
+    get_write_behind_queue().submit(('xp', username), amount, merge_sum, write_xp)
+
+def load_gratitude_entries(username):
+    """Load user's gratitude journal entries, including ones still waiting to be written"""
+    def load():
+        return [
+            {'entry': row['entry'], 'timestamp': row['timestamp']}
+            for row in get_user_db().execute(
+                "SELECT entry, timestamp FROM gratitude_entries WHERE username = ? ORDER BY id", (username,)
+            )
+        ]
+    
+    key = ('gratitude', username)
+    entries, pending = get_write_behind_queue().overlay([key], lambda: get_user_records().get('gratitude', username, load))
+    return entries + pending.get(key, [])
+
+def write_gratitude_entries(db, key, entries):
+    insert_user_rows(db, 'gratitude_entries', ('entry', 'timestamp'), key[1], [(e['entry'], e['timestamp']) for e in entries])
+
+def save_gratitude_entry(username, entry):
+    """Save a gratitude journal entry"""
+    get_write_behind_queue().submit(
+        ('gratitude', username), [{'entry': entry, 'timestamp': datetime.now().isoformat()}], merge_sum, write_gratitude_entries
+    )
+
+# ======================
+# LOCAL MODEL ARTIFACTS
+# ======================
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64,
+    'F32': torch.float32,
+    'F16': torch.float16,
+    'BF16': torch.bfloat16,
+    'I64': torch.int64,
+    'I32': torch.int32,
+    'I16': torch.int16,
+    'I8': torch.int8,
+    'U8': torch.uint8,
+    'BOOL': torch.bool
+}
+
+def is_local_artifact(source):
+    """True if source is a directory holding safetensors weights and a fast tokenizer"""
+    model_dir = Path(source)
+    has_weights = (model_dir / 'model.safetensors').exists() or (model_dir / 'model.safetensors.index.json').exists()
+    return has_weights and (model_dir / 'tokenizer.json').exists()
+
+def load_emotion_labels(model_dir=None):
+    """Labels from the artifact's emotion_labels.json, else the bundled file, else the risk mapping"""
+    candidates = [BUNDLED_EMOTION_LABELS_FILE]
+    if model_dir is not None:
+        candidates.insert(0, Path(model_dir) / 'emotion_labels.json')
+    
+    for labels_file in candidates:
+        if labels_file.exists():
+            with open(labels_file, 'r') as f:
+                return json.load(f)
+    return list(MENTAL_HEALTH_MAPPING.keys())
+
+def mmap_safetensors(path):
+    """
+    Map a safetensors file into memory and return its tensors without copying
+    
+    The file is mapped copy-on-write, so the weights are paged in lazily and
+    shared through the page cache between every process serving the same file.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    
+    header_size = struct.unpack('<Q', mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_size])
+    data_start = 8 + header_size
+    
+    tensors = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        start, end = info['data_offsets']
+        if end == start:
+            tensors[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        element_size = torch.empty((), dtype=dtype).element_size()
+        tensors[name] = torch.frombuffer(
+            mapped,
+            dtype=dtype,
+            count=(end - start) // element_size,
+            offset=data_start + start
+        ).reshape(info['shape'])
+    return tensors
+
+@contextmanager
+def init_empty_parameters():
+    """Create module parameters on the meta device while keeping buffers on the CPU"""
+    register_parameter = torch.nn.Module.register_parameter
+    
+    def register_empty_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            param = module._parameters[name]
+            module._parameters[name] = type(param)(param.to('meta'), requires_grad=param.requires_grad)
+    
+    torch.nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+def load_local_classifier(model_dir):
+    """Build the classifier from a local artifact directory with memory-mapped weights, without network access"""
+    model_dir = Path(model_dir)
+    config = RobertaConfig.from_pretrained(model_dir, local_files_only=True)
+    
+    index_file = model_dir / 'model.safetensors.index.json'
+    if index_file.exists():
+        with open(index_file, 'r') as f:
+            shard_names = sorted(set(json.load(f)['weight_map'].values()))
+    else:
+        shard_names = ['model.safetensors']
+    
+    state_dict = {}
+    for shard_name in shard_names:
+        state_dict.update(mmap_safetensors(model_dir / shard_name))
+    
+    with init_empty_parameters():
+        model = RobertaForSequenceClassification(config)
+    
+    # assign=True adopts the mapped tensors as parameters instead of copying into them
+    result = model.load_state_dict(state_dict, strict=False, assign=True)
+    if result.missing_keys:
+        raise ValueError(f"Model artifact in {model_dir} is missing weights: {', '.join(result.missing_keys)}")
+    
+    model.eval()
+    return model
+
+# ======================
+# INFERENCE BACKENDS
+# ======================
+class OnnxEmotionClassifier:
+    """ONNX Runtime session that can be called like the torch classifier"""
+    
+    def __init__(self, onnx_path):
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Follow the torch thread setting so autotuned thread counts apply to both runtimes
+        session_options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(
+            str(onnx_path),
+            sess_options=session_options,
+            providers=['CPUExecutionProvider']
+        )
+        self.device = torch.device('cpu')
+    
+    def eval(self):
+        return self
+    
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        logits = self.session.run(['logits'], {
+            'input_ids': input_ids.cpu().numpy().astype(np.int64),
+            'attention_mask': attention_mask.cpu().numpy().astype(np.int64)
+        })[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+class CascadeEmotionClassifier:
+    """
+    Two-stage classifier: a fast model first, the full model only when needed
+    
+    A row is escalated to the full model when the fast model's top-1
+    confidence is below min_confidence, its top-1/top-2 margin is below
+    min_margin, or a high-risk emotion appears in its top risk_top_k labels.
+    Escalated rows take the full model's logits; the rest keep the fast ones.
+    """
+    
+    def __init__(self, fast_model, full_model, emotion_labels, min_confidence=CASCADE_MIN_CONFIDENCE,
+                 min_margin=CASCADE_MIN_MARGIN, risk_top_k=CASCADE_RISK_TOP_K):
+        self.fast_model = fast_model
+        self.full_model = full_model
+        self.device = full_model.device
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.risk_top_k = min(risk_top_k, len(emotion_labels))
+        self.high_risk_indices = torch.tensor([
+            i for i, emotion in enumerate(emotion_labels)
+            if MENTAL_HEALTH_MAPPING.get(emotion, {}).get('risk_level') == 'high'
+        ], dtype=torch.long)
+        self.stats = {'sequences': 0, 'escalated': 0, 'fast_seconds': 0.0, 'full_seconds': 0.0}
+        self._lock = threading.Lock()
+    
+    def eval(self):
+        self.fast_model.eval()
+        self.full_model.eval()
+        return self
+    
+    def needs_escalation(self, logits):
+        """Boolean mask of rows the fast model should not answer on its own"""
+        probs = torch.nn.functional.softmax(logits.float(), dim=-1)
+        top_probs, top_indices = torch.topk(probs, k=max(self.risk_top_k, 2), dim=-1)
+        uncertain = (top_probs[:, 0] < self.min_confidence) | (top_probs[:, 0] - top_probs[:, 1] < self.min_margin)
+        high_risk = torch.isin(top_indices[:, :self.risk_top_k], self.high_risk_indices.to(top_indices.device)).any(dim=-1)
+        return uncertain | high_risk
+    
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        start = time.perf_counter()
+        logits = self.fast_model(
+            input_ids=input_ids.to(self.fast_model.device),
+            attention_mask=attention_mask.to(self.fast_model.device)
+        ).logits.float()
+        fast_seconds = time.perf_counter() - start
+        
+        escalate = self.needs_escalation(logits).cpu()
+        full_seconds = 0.0
+        if escalate.any():
+            # Trim the padding columns the escalated rows don't need
+            escalated_mask = attention_mask[escalate]
+            width = int(escalated_mask.sum(dim=1).max())
+            start = time.perf_counter()
+            full_logits = self.full_model(
+                input_ids=input_ids[escalate][:, :width].to(self.full_model.device),
+                attention_mask=escalated_mask[:, :width].to(self.full_model.device)
+            ).logits.float()
+            full_seconds = time.perf_counter() - start
+            logits = logits.cpu()
+            logits[escalate] = full_logits.cpu()
+        
+        with self._lock:
+            self.stats['sequences'] += len(input_ids)
+            self.stats['escalated'] += int(escalate.sum())
+            self.stats['fast_seconds'] += fast_seconds
+            self.stats['full_seconds'] += full_seconds
+        
+        return SimpleNamespace(logits=logits)
+    
+    def get_stats(self):
+        """
+        Escalation rate and estimated latency saved versus running the full model on everything
+        
+        The saving is estimated from the full model's measured cost per
+        escalated sequence, so it is only available once something escalated.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats['escalation_rate'] = stats['escalated'] / stats['sequences'] if stats['sequences'] else 0.0
+        stats['seconds_saved'] = None
+        if stats['escalated']:
+            full_only_seconds = stats['full_seconds'] / stats['escalated'] * stats['sequences']
+            stats['seconds_saved'] = full_only_seconds - stats['fast_seconds'] - stats['full_seconds']
+        return stats
+
+class EarlyExitEmotionClassifier:
+    """
+    Runs the RoBERTa encoder layer by layer and stops early for confident rows
+    
+    After each layer that has an exit head, rows whose head confidence reaches
+    the threshold take that head's logits and are dropped from the batch, so
+    the remaining layers only run on the ambiguous rows. Rows that never clear
+    the threshold get the model's own classifier after the last layer.
+    """
+    
+    def __init__(self, model, exit_heads, threshold=EARLY_EXIT_THRESHOLD):
+        self.model = model
+        self.exit_heads = exit_heads
+        self.threshold = threshold
+        self.device = model.device
+        self.num_layers = len(model.roberta.encoder.layer)
+        self.stats = {'sequences': 0, 'layers_run': 0, 'exits': {}}
+        self._lock = threading.Lock()
+    
+    def eval(self):
+        self.model.eval()
+        for head in self.exit_heads.values():
+            head.eval()
+        return self
+    
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        roberta = self.model.roberta
+        input_ids = input_ids.to(self.device)
+        attention_mask = attention_mask.to(self.device)
+        
+        hidden_states = roberta.embeddings(input_ids=input_ids)
+        logits = torch.zeros(len(input_ids), self.model.config.num_labels, device=self.device)
+        exit_layers = torch.full((len(input_ids),), self.num_layers, device=self.device)
+        active = torch.arange(len(input_ids), device=self.device)
+        mask = attention_mask
+        
+        for depth, layer in enumerate(roberta.encoder.layer, 1):
+            # Additive mask over key positions, which every attention implementation accepts
+            extended_mask = (1.0 - mask[:, None, None, :].to(hidden_states.dtype)) * torch.finfo(hidden_states.dtype).min
+            output = layer(hidden_states, extended_mask)
+            hidden_states = output[0] if isinstance(output, tuple) else output
+            
+            if depth == self.num_layers:
+                logits[active] = self.model.classifier(hidden_states).float()
+                break
+            
+            head = self.exit_heads.get(depth)
+            if head is None:
+                continue
+            head_logits = head(hidden_states).float()
+            confident = torch.nn.functional.softmax(head_logits, dim=-1).max(dim=-1).values >= self.threshold
+            if confident.any():
+                logits[active[confident]] = head_logits[confident]
+                exit_layers[active[confident]] = depth
+                remaining = ~confident
+                active, hidden_states, mask = active[remaining], hidden_states[remaining], mask[remaining]
+                if len(active) == 0:
+                    break
+        
+        with self._lock:
+            self.stats['sequences'] += len(input_ids)
+            self.stats['layers_run'] += int(exit_layers.sum())
+            for depth, count in zip(*torch.unique(exit_layers, return_counts=True)):
+                self.stats['exits'][int(depth)] = self.stats['exits'].get(int(depth), 0) + int(count)
+        
+        return SimpleNamespace(logits=logits)
+    
+    def get_stats(self):
+        """Per-exit-layer counts, average depth and the resulting encoder layer speedup"""
+        with self._lock:
+            stats = {'sequences': self.stats['sequences'], 'layers_run': self.stats['layers_run'], 'exits': dict(sorted(self.stats['exits'].items()))}
+        stats['average_depth'] = stats['layers_run'] / stats['sequences'] if stats['sequences'] else float(self.num_layers)
+        stats['layer_speedup'] = self.num_layers / stats['average_depth']
+        return stats
+
+def load_early_exit_classifier(model, notices):
+    """
+    Attach the notebook-trained exit heads from the local artifact to a torch classifier
+    
+    Returns the model unchanged, with a notice, when the artifact has no heads.
+    """
+    model_dir = Path(MODEL_SOURCE)
+    heads_path = model_dir / EARLY_EXIT_HEADS_FILE
+    config_path = model_dir / EARLY_EXIT_CONFIG_FILE
+    if not (heads_path.exists() and config_path.exists()):
+        notices.append(f"Early exit needs {EARLY_EXIT_HEADS_FILE} and {EARLY_EXIT_CONFIG_FILE} in a local model directory; running at full depth.")
+        return model
+    
+    with open(config_path, 'r') as f:
+        exit_layers = json.load(f)['exit_layers']
+    state_dict = mmap_safetensors(heads_path)
+    
+    exit_heads = {}
+    for exit_layer in exit_layers:
+        head = RobertaClassificationHead(model.config)
+        prefix = f"exit_{exit_layer}."
+        head.load_state_dict({key[len(prefix):]: value for key, value in state_dict.items() if key.startswith(prefix)})
+        exit_heads[exit_layer] = head.to(model.device).eval()
+    
+    return EarlyExitEmotionClassifier(model, exit_heads)
+
+def load_torch_classifier(device, source=MODEL_SOURCE):
+    """Load the eager PyTorch classifier from MODEL_SOURCE (or another checkpoint)"""
+    if is_local_artifact(source):
+        return load_local_classifier(source).to(device)
+    return RobertaForSequenceClassification.from_pretrained(
+        source,
+        trust_remote_code=True
+    ).to(device)
+
+def load_tokenizer():
+    """Load the tokenizer for MODEL_SOURCE, using the fast tokenizer JSON for local artifacts"""
+    if is_local_artifact(MODEL_SOURCE):
+        return RobertaTokenizerFast.from_pretrained(MODEL_SOURCE, local_files_only=True)
+    return RobertaTokenizer.from_pretrained(
+        MODEL_SOURCE,
+        trust_remote_code=True
+    )
+
+def get_backend_cache_dir(backend, *version_parts):
+    """Cache directory for a derived model artifact of MODEL_SOURCE"""
+    cache_key = '|'.join((MODEL_SOURCE,) + version_parts)
+    return MODEL_CACHE_DIR / backend / hashlib.sha256(cache_key.encode()).hexdigest()[:16]
+
+def get_onnx_export_path():
+    """Location of the cached ONNX export for MODEL_SOURCE"""
+    return get_backend_cache_dir('onnx') / 'model.onnx'
+
+def export_onnx_classifier(model, tokenizer, export_path):
+    """Export the torch classifier to ONNX with dynamic batch and sequence axes"""
+    sample = tokenizer(BENCHMARK_TEXTS, padding=True, return_tensors="pt")
+    export_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = export_path.with_suffix('.onnx.tmp')
+    
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter understands dynamic_axes directly
+        export_kwargs['dynamo'] = False
+    
+    model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample['input_ids'], sample['attention_mask']),
+            str(temp_path),
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch'}
+            },
+            opset_version=14,
+            **export_kwargs
+        )
+    # Rename into place so other replicas never pick up a half-written export
+    os.replace(temp_path, export_path)
+
+def check_onnx_parity(model, onnx_model, tokenizer):
+    """Return the largest absolute logit difference between torch and ONNX on sample texts"""
+    inputs = tokenizer(BENCHMARK_TEXTS, padding=True, return_tensors="pt")
+    model.eval()
+    with torch.no_grad():
+        torch_logits = model(**inputs).logits
+    onnx_logits = onnx_model(**inputs).logits
+    return (torch_logits - onnx_logits).abs().max().item()
+
+def load_onnx_classifier(tokenizer, notices):
+    """
+    Load the ONNX Runtime classifier, exporting and verifying it on first use
+    
+    The export is cached under MODEL_CACHE_DIR together with the result of the
+    parity check, so later starts skip both the torch load and the export.
+    Returns None (and appends the reason to notices) when onnxruntime is
+    missing or the export does not match torch.
+    """
+    if ort is None:
+        notices.append("onnxruntime is not installed. Falling back to the PyTorch backend.")
+        return None
+    
+    export_path = get_onnx_export_path()
+    parity_path = export_path.with_name('parity.json')
+    
+    if export_path.exists() and parity_path.exists():
+        with open(parity_path, 'r') as f:
+            if json.load(f).get('passed'):
+                return OnnxEmotionClassifier(export_path)
+    
+    torch_model = load_torch_classifier(torch.device('cpu'))
+    export_onnx_classifier(torch_model, tokenizer, export_path)
+    onnx_model = OnnxEmotionClassifier(export_path)
+    
+    max_diff = check_onnx_parity(torch_model, onnx_model, tokenizer)
+    passed = max_diff <= ONNX_PARITY_TOLERANCE
+    with open(parity_path, 'w') as f:
+        json.dump({
+            'model_source': MODEL_SOURCE,
+            'max_abs_logit_diff': max_diff,
+            'tolerance': ONNX_PARITY_TOLERANCE,
+            'passed': passed,
+            'exported_at': datetime.now().isoformat()
+        }, f, indent=2)
+    
+    if not passed:
+        notices.append(f"ONNX export differs from PyTorch by {max_diff:.2e} (tolerance {ONNX_PARITY_TOLERANCE:.0e}). Falling back to the PyTorch backend.")
+        return None
+    
+    return onnx_model
+
+class LogitsOnlyClassifier(torch.nn.Module):
+    """Adapter returning bare logits, which is what torch.jit.trace needs"""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class TracedEmotionClassifier:
+    """
+    TorchScript graphs of the classifier traced at fixed sequence-length buckets
+    
+    Each batch is right-padded up to the smallest bucket that fits it and run
+    through that bucket's graph, so only a handful of shapes are ever seen and
+    short chat messages skip eager-mode dispatch overhead. Batches longer than
+    the largest bucket fall back to the eager model.
+    """
+    
+    def __init__(self, model, tokenizer, buckets=SEQUENCE_LENGTH_BUCKETS):
+        self.model = model
+        self.device = model.device
+        self.pad_token_id = tokenizer.pad_token_id
+        self.buckets = sorted(buckets)
+        self.graphs = {}
+        
+        model.eval()
+        adapter = LogitsOnlyClassifier(model).eval()
+        for bucket in self.buckets:
+            sample = tokenizer(
+                BENCHMARK_TEXTS[:2],
+                truncation=True,
+                padding='max_length',
+                max_length=bucket,
+                return_tensors="pt"
+            ).to(self.device)
+            with torch.no_grad():
+                self.graphs[bucket] = torch.jit.trace(adapter, (sample['input_ids'], sample['attention_mask']), check_trace=False)
+    
+    def eval(self):
+        return self
+    
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        length = input_ids.shape[1]
+        bucket = next((size for size in self.buckets if size >= length), None)
+        if bucket is None:
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)
+        
+        if bucket > length:
+            input_ids = torch.nn.functional.pad(input_ids, (0, bucket - length), value=self.pad_token_id)
+            attention_mask = torch.nn.functional.pad(attention_mask, (0, bucket - length), value=0)
+        with torch.no_grad():
+            logits = self.graphs[bucket](input_ids.to(self.device), attention_mask.to(self.device))
+        return SimpleNamespace(logits=logits)
+
+def check_traced_parity(model, traced_model, tokenizer):
+    """Largest absolute logit difference between eager and traced, across every bucket"""
+    long_text = " ".join(BENCHMARK_TEXTS * 4)
+    max_diff = 0.0
+    model.eval()
+    for bucket in traced_model.buckets:
+        # The long text fills the batch to just under the bucket, so short rows get heavily padded
+        inputs = tokenizer(
+            BENCHMARK_TEXTS + [long_text],
+            truncation=True,
+            padding=True,
+            max_length=max(bucket - 1, 2),
+            return_tensors="pt"
+        ).to(model.device)
+        with torch.no_grad():
+            eager_logits = model(**inputs).logits
+            traced_logits = traced_model(**inputs).logits
+        max_diff = max(max_diff, (eager_logits - traced_logits).abs().max().item())
+    return max_diff
+
+def load_traced_classifier(device, tokenizer, notices):
+    """
+    Trace the torch classifier at every sequence-length bucket and verify it against eager
+    
+    Returns the eager model (and appends the reason to notices) when the
+    traced logits differ by more than TRACED_PARITY_TOLERANCE.
+    """
+    model = load_torch_classifier(device)
+    traced_model = TracedEmotionClassifier(model, tokenizer)
+    max_diff = check_traced_parity(model, traced_model, tokenizer)
+    if max_diff > TRACED_PARITY_TOLERANCE:
+        notices.append(f"Traced model differs from eager by {max_diff:.2e} (tolerance {TRACED_PARITY_TOLERANCE:.0e}). Falling back to the PyTorch backend.")
+        return model
+    return traced_model
+
+def cpu_supports_bf16():
+    """True if this CPU has native bf16 matmul support (AVX512-BF16 or AMX)"""
+    checks = (getattr(torch.cpu, '_is_avx512_bf16_supported', None), getattr(torch.cpu, '_is_amx_tile_supported', None))
+    return any(check() for check in checks if check is not None)
+
+def get_validation_texts():
+    """Held-out texts for accuracy guardrails from SOUL_VALIDATION_TEXTS, or [] if none are configured"""
+    if not VALIDATION_TEXTS_FILE or not Path(VALIDATION_TEXTS_FILE).exists():
+        return []
+    texts = [clean_text(str(text)) for text in pd.read_csv(VALIDATION_TEXTS_FILE)['text']]
+    return [text for text in texts if text]
+
+def load_bf16_classifier(tokenizer, emotion_labels, notices):
+    """
+    Load the classifier in bfloat16 on CPUs with native bf16 support
+    
+    The bf16 copy must agree with fp32 on the top-1 emotion for at least
+    BF16_MIN_TOP1_AGREEMENT of the held-out texts in SOUL_VALIDATION_TEXTS;
+    without them bf16 is not enabled. The comparison report is cached, so it
+    only runs again when the model, torch or the texts change. Returns the
+    fp32 model (and appends the reason to notices) otherwise.
+    """
+    fp32_model = load_torch_classifier(torch.device('cpu'))
+    if not cpu_supports_bf16():
+        notices.append("This CPU has no native bf16 support. Using fp32 instead.")
+        return fp32_model
+    
+    texts = get_validation_texts()
+    if not texts:
+        notices.append(
+            "bf16 needs held-out validation texts to check its accuracy. "
+            "Set SOUL_VALIDATION_TEXTS to a CSV with a 'text' column. Using fp32 instead."
+        )
+        return fp32_model
+    texts_hash = hashlib.sha256("\n".join(texts).encode()).hexdigest()[:16]
+    report_path = get_backend_cache_dir('bf16', torch.__version__, transformers.__version__, texts_hash) / 'comparison.json'
+    
+    bf16_model = copy.deepcopy(fp32_model).to(torch.bfloat16).eval()
+    if report_path.exists():
+        with open(report_path, 'r') as f:
+            report = json.load(f)
+    else:
+        report = compare_classifiers(fp32_model, bf16_model, tokenizer, emotion_labels, texts)
+        report.update({
+            'model_source': MODEL_SOURCE,
+            'fp32_size_mb': get_model_size_mb(fp32_model),
+            'bf16_size_mb': get_model_size_mb(bf16_model),
+            'min_top1_agreement': BF16_MIN_TOP1_AGREEMENT,
+            'created_at': datetime.now().isoformat()
+        })
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    if report['top1_agreement'] < BF16_MIN_TOP1_AGREEMENT:
+        notices.append(
+            f"bf16 agreed with fp32 on only {report['top1_agreement']*100:.1f}% of validation texts "
+            f"(minimum {BF16_MIN_TOP1_AGREEMENT*100:.0f}%). Using fp32 instead."
+        )
+        return fp32_model
+    return bf16_model
+
+def get_quantized_model_path():
+    """Location of the cached int8 model; pickled modules are tied to the torch/transformers versions"""
+    return get_backend_cache_dir('quantized', torch.__version__, transformers.__version__) / 'model.pt'
+
+def quantize_classifier(model):
+    """Dynamically quantize the Linear layers of a CPU classifier to int8"""
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def get_model_size_mb(model):
+    """Serialized size of a model's state dict in megabytes"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / (1024 * 1024)
+
+def time_classifier(model, inputs, repeats=5):
+    """Median forward-pass latency in milliseconds"""
+    timings = []
+    with torch.no_grad():
+        model(**inputs)  # warm-up
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(**inputs)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def compare_classifiers(reference_model, candidate_model, tokenizer, emotion_labels, texts=BENCHMARK_TEXTS):
+    """
+    Compare a candidate backend against the fp32 reference model
+    
+    Reports top-1 agreement over the emotion label set and the largest
+    probability difference on texts, scored in length-sorted mini-batches so
+    a large validation set stays cheap, plus batch / single-text latency for
+    both models on the fixed BENCHMARK_TEXTS sample.
+    """
+    sequences = tokenizer(texts, truncation=True, max_length=MAX_SEQUENCE_LENGTH)['input_ids']
+    reference_probs = run_sequences(sequences, reference_model, tokenizer, INFERENCE_BATCH_SIZE)
+    candidate_probs = run_sequences(sequences, candidate_model, tokenizer, INFERENCE_BATCH_SIZE)
+    
+    inputs = tokenizer(BENCHMARK_TEXTS, padding=True, truncation=True, max_length=MAX_SEQUENCE_LENGTH, return_tensors="pt")
+    single = tokenizer(BENCHMARK_TEXTS[:1], return_tensors="pt")
+    
+    reference_top1 = reference_probs.argmax(dim=-1)
+    candidate_top1 = candidate_probs.argmax(dim=-1)
+    disagreements = {}
+    for ref_idx, cand_idx in zip(reference_top1.tolist(), candidate_top1.tolist()):
+        if ref_idx != cand_idx:
+            label = emotion_labels[ref_idx]
+            disagreements[label] = disagreements.get(label, 0) + 1
+    
+    reference_batch_ms = time_classifier(reference_model, inputs)
+    candidate_batch_ms = time_classifier(candidate_model, inputs)
+    
+    return {
+        'samples': len(texts),
+        'top1_agreement': (reference_top1 == candidate_top1).float().mean().item(),
+        'max_prob_diff': (reference_probs - candidate_probs).abs().max().item(),
+        'disagreements_by_label': disagreements,
+        'reference_batch_ms': reference_batch_ms,
+        'candidate_batch_ms': candidate_batch_ms,
+        'reference_single_ms': time_classifier(reference_model, single),
+        'candidate_single_ms': time_classifier(candidate_model, single),
+        'batch_speedup': reference_batch_ms / candidate_batch_ms if candidate_batch_ms > 0 else 0
+    }
+
+def load_quantized_classifier(tokenizer, emotion_labels):
+    """
+    Load the int8 dynamically quantized classifier, building and caching it on first use
+    
+    The first start quantizes the fp32 model, compares it against fp32 and
+    writes the report next to the cached model. Later starts load the
+    quantized module directly without touching the fp32 weights.
+    """
+    model_path = get_quantized_model_path()
+    report_path = model_path.with_name('comparison.json')
+    
+    if model_path.exists():
+        return torch.load(model_path, map_location='cpu', weights_only=False)
+    
+    fp32_model = load_torch_classifier(torch.device('cpu'))
+    quantized_model = quantize_classifier(fp32_model)
+    
+    report = compare_classifiers(fp32_model, quantized_model, tokenizer, emotion_labels)
+    report.update({
+        'model_source': MODEL_SOURCE,
+        'fp32_size_mb': get_model_size_mb(fp32_model),
+        'int8_size_mb': get_model_size_mb(quantized_model),
+        'created_at': datetime.now().isoformat()
+    })
+    
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = model_path.with_suffix('.pt.tmp')
+    torch.save(quantized_model, temp_path)
+    os.replace(temp_path, model_path)
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    
+    return quantized_model
+
+def build_model(backend=MODEL_BACKEND, notices=None):
+    """Load the emotion classifier and tokenizer for the requested inference backend ('torch', 'traced', 'bf16', 'onnx' or 'quantized')"""
+    if notices is None:
+        notices = []
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    
+    tokenizer = load_tokenizer()
+    
+    # Prefer emotion_labels.json shipped with the artifact, then the bundled copy
+    emotion_labels = load_emotion_labels(MODEL_SOURCE if is_local_artifact(MODEL_SOURCE) else None)
+    
+    model = None
+    if backend == 'onnx':
+        model = load_onnx_classifier(tokenizer, notices)
+    elif backend == 'quantized':
+        # Dynamic int8 kernels only run on CPU
+        model = load_quantized_classifier(tokenizer, emotion_labels)
+    elif backend == 'traced':
+        model = load_traced_classifier(device, tokenizer, notices)
+        if not isinstance(model, TracedEmotionClassifier):
+            backend = 'torch'
+    elif backend == 'bf16':
+        model = load_bf16_classifier(tokenizer, emotion_labels, notices)
+        if model.dtype != torch.bfloat16:
+            backend = 'torch'
+    
+    if model is None:
+        # Load model directly from Hugging Face (or a local checkpoint directory)
+        backend = 'torch'
+        model = load_torch_classifier(device)
+    
+    # Cached predictions are keyed on this so they never cross models or backends
+    model_version = f"{MODEL_SOURCE}@{backend}"
+    
+    if EARLY_EXIT_ENABLED:
+        if backend == 'torch':
+            model = load_early_exit_classifier(model, notices)
+            if isinstance(model, EarlyExitEmotionClassifier):
+                model_version = f"{model_version}+early-exit:{EARLY_EXIT_THRESHOLD}"
+        else:
+            notices.append(f"Early exit is only available with the torch backend, not '{backend}'.")
+    
+    if CASCADE_FAST_MODEL_PATH:
+        # The fast model must share the full model's tokenizer and label order
+        fast_model = load_torch_classifier(model.device, CASCADE_FAST_MODEL_PATH)
+        model = CascadeEmotionClassifier(fast_model, model, emotion_labels)
+        model_version = f"{model_version}+cascade:{CASCADE_FAST_MODEL_PATH}"
+    
+    model.model_version = model_version
+    model.batch_size = INFERENCE_BATCH_SIZE
+    
+    embedding_head = get_embedding_head(model)
+    if embedding_head is not None:
+        attach_embedding_capture(embedding_head)
+    
+    return model, tokenizer, emotion_labels
+
+def get_embedding_head(model):
+    """
+    The classification head whose <s> input features serve as text embeddings, or None
+    
+    Every row has to pass through the head for the embeddings to share one
+    space, so cascades use their fast stage and early-exit models their first
+    exit head. Traced and ONNX graphs can't be hooked and have no embeddings.
+    """
+    if isinstance(model, CascadeEmotionClassifier):
+        return get_embedding_head(model.fast_model)
+    if isinstance(model, EarlyExitEmotionClassifier):
+        return model.exit_heads[min(model.exit_heads)] if model.exit_heads else model.model.classifier
+    head = getattr(model, 'classifier', None)
+    return head if isinstance(head, torch.nn.Module) else None
+
+def attach_embedding_capture(head):
+    """
+    Hook the head so a thread can collect its <s> features from its own forward passes
+    
+    The capture state lives on the module (not in a script global), so it
+    survives Streamlit reruns, and it is thread-local so the micro-batching
+    worker and direct callers never see each other's features.
+    """
+    capture = getattr(head, 'embedding_capture', None)
+    if capture is None:
+        capture = threading.local()
+        
+        def capture_features(module, args):
+            if getattr(capture, 'active', False):
+                capture.features = args[0][:, 0].float().cpu()
+        
+        head.register_forward_pre_hook(capture_features)
+        head.embedding_capture = capture
+    return capture
+
+def get_model_stages(model):
+    """
+    The plain classifiers inside a cascade or early-exit wrapper
+    
+    Warm-up runs these directly so it doesn't count towards the wrappers' stats.
+    """
+    if isinstance(model, CascadeEmotionClassifier):
+        return get_model_stages(model.fast_model) + get_model_stages(model.full_model)
+    if isinstance(model, EarlyExitEmotionClassifier):
+        return (model.model,)
+    return (model,)
+
+def warm_up_model(model, tokenizer):
+    """Run forward passes at representative sequence lengths so first requests skip one-time setup costs"""
+    warm_up_text = " ".join(BENCHMARK_TEXTS * 4)
+    for stage in get_model_stages(model):
+        stage.eval()
+        for sequence_length in WARMUP_SEQUENCE_LENGTHS:
+            for batch_size in (1, get_batch_size(model)):
+                inputs = tokenizer(
+                    [warm_up_text] * batch_size,
+                    truncation=True,
+                    padding='max_length',
+                    max_length=sequence_length,
+                    return_tensors="pt"
+                ).to(stage.device)
+                with torch.no_grad():
+                    stage(**inputs)
+
+class ModelPreloader:
+    """
+    Loads and warms up the model in a background thread
+    
+    state moves from 'loading' (or 'tuning' when SOUL_AUTOTUNE=1) to 'warming'
+    to 'ready' (or 'failed'), so pages can check readiness without blocking
+    the script thread.
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.state = 'tuning' if AUTOTUNE_ENABLED else 'loading'
+        self.result = None
+        self.error = None
+        self.notices = []
+        self.settings = None
+        self.load_seconds = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="emotion-model-preloader", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            backend = self.backend
+            if AUTOTUNE_ENABLED:
+                self.settings = load_autotune_settings() or run_autotune(self.notices)
+                apply_inference_settings(self.settings)
+                backend = self.settings['backend']
+                self.state = 'loading'
+            
+            model, tokenizer, emotion_labels = build_model(backend, self.notices)
+            if self.settings:
+                model.batch_size = self.settings['batch_size']
+            self.state = 'warming'
+            warm_up_model(model, tokenizer)
+            self.result = (model, tokenizer, emotion_labels)
+            self.state = 'ready'
+        except Exception as e:
+            self.error = e
+            self.state = 'failed'
+        finally:
+            self.load_seconds = time.perf_counter() - start
+            self._done.set()
+    
+    def is_ready(self):
+        return self._done.is_set()
+    
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+@st.cache_resource(show_spinner=False)
+def get_model_preloader(backend=MODEL_BACKEND):
+    """Start loading the model for this process; the first script run triggers it"""
+    return ModelPreloader(backend)
+
+def load_model(backend=MODEL_BACKEND):
+    """Return the preloaded model without waiting; (None, None, None) while it is still loading or if loading failed"""
+    preloader = get_model_preloader(backend)
+    if not preloader.is_ready():
+        return None, None, None
+    
+    if not st.session_state.get('model_notices_shown'):
+        for notice in preloader.notices:
+            st.warning(notice)
+        st.session_state.model_notices_shown = True
+    
+    if preloader.error is not None:
+        # Forget the failed attempt so the next rerun tries again
+        get_model_preloader.clear()
+        st.error(f"❌ Error loading model from Hugging Face: {str(preloader.error)}")
+        st.info(f"Please ensure '{MODEL_SOURCE}' is a valid Hugging Face model repository.")
+        st.info("Make sure your model is public or you have the correct access permissions.")
+        return None, None, None
+    
+    return preloader.result
+
+def show_model_warming_status(preloader):
+    """Status banner for model pages while the background load is still running"""
+    steps = {
+        'tuning': "Tuning inference settings for this machine",
+        'loading': "Loading the AI model",
+        'warming': "AI model warming up"
+    }
+    st.info(f"🔄 {steps.get(preloader.state, 'Preparing the AI model')}... Analysis will be available in a moment.")
+
+def initialize_hf_chatbot():
+    """Initialize Hugging Face chatbot client"""
+    try:
+        client = Client("SENTIBOT2705/mentalhealthbot-phi2")
+        return client
+    except Exception as e:
+        st.error(f"Failed to initialize chatbot: {str(e)}")
+        return None
+
+@st.cache_resource
+def get_chatbot_client():
+    return initialize_hf_chatbot()
+
+# ======================
+# CPU AUTOTUNING
+# ======================
+def get_autotune_path():
+    """Per-host location of the autotuned settings; core count and torch version invalidate it"""
+    return get_backend_cache_dir('autotune', socket.gethostname(), str(os.cpu_count()), torch.__version__) / 'settings.json'
+
+def get_autotune_thread_counts():
+    """Intra-op thread counts to try: powers of two up to the core count, plus the core count"""
+    cores = os.cpu_count() or 1
+    counts = {1, cores}
+    threads = 2
+    while threads < cores:
+        counts.add(threads)
+        threads *= 2
+    return sorted(counts)
+
+def make_autotune_sequences(tokenizer, count=AUTOTUNE_SEQUENCES):
+    """Synthetic token id sequences cycling through the warm-up lengths"""
+    ids = tokenizer(" ".join(BENCHMARK_TEXTS * 4), add_special_tokens=False)['input_ids']
+    return [
+        [tokenizer.cls_token_id] + ids[:WARMUP_SEQUENCE_LENGTHS[i % len(WARMUP_SEQUENCE_LENGTHS)] - 2] + [tokenizer.sep_token_id]
+        for i in range(count)
+    ]
+
+def time_inference_settings(model, tokenizer, sequences, batch_size, repeats=3):
+    """Median milliseconds per sequence for running all sequences at the given batch size"""
+    run_sequences(sequences[:batch_size], model, tokenizer, batch_size)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_sequences(sequences, model, tokenizer, batch_size)
+        timings.append((time.perf_counter() - start) * 1000 / len(sequences))
+    return float(np.median(timings))
+
+def run_autotune(notices):
+    """
+    Benchmark every backend / thread count / batch size combination and cache the fastest
+    
+    Backends that aren't available here (e.g. ONNX without onnxruntime) are
+    skipped. The result is written to get_autotune_path(), so the grid only
+    runs on the first start on each host.
+    """
+    thread_counts = get_autotune_thread_counts()
+    grid = []
+    
+    for backend in AUTOTUNE_BACKENDS:
+        backend_notices = []
+        model, tokenizer, _ = build_model(backend, backend_notices)
+        if f"@{backend}" not in model.model_version:
+            notices.append(f"Autotuning skipped the '{backend}' backend: {' '.join(backend_notices)}")
+            continue
+        
+        sequences = make_autotune_sequences(tokenizer)
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            if isinstance(model, OnnxEmotionClassifier):
+                # ONNX Runtime fixes its thread pool when the session is created
+                model = OnnxEmotionClassifier(get_onnx_export_path())
+            for batch_size in AUTOTUNE_BATCH_SIZES:
+                grid.append({
+                    'backend': backend,
+                    'threads': threads,
+                    'batch_size': batch_size,
+                    'ms_per_text': time_inference_settings(model, tokenizer, sequences, batch_size)
+                })
+        del model
+    
+    if not grid:
+        raise RuntimeError(f"No autotuning backend could be loaded from: {', '.join(AUTOTUNE_BACKENDS)}")
+    
+    best = min(grid, key=lambda result: result['ms_per_text'])
+    settings = {
+        'backend': best['backend'],
+        'threads': best['threads'],
+        # Forward passes don't use inter-op parallelism; one thread keeps it from competing with intra-op threads
+        'interop_threads': 1,
+        'batch_size': best['batch_size'],
+        'ms_per_text': best['ms_per_text'],
+        'host': socket.gethostname(),
+        'cpu_count': os.cpu_count(),
+        'grid': grid,
+        'tuned_at': datetime.now().isoformat()
+    }
+    
+    settings_path = get_autotune_path()
+    settings_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(settings_path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    return settings
+
+def load_autotune_settings():
+    """Previously tuned settings for this host, or None"""
+    settings_path = get_autotune_path()
+    if not settings_path.exists():
+        return None
+    with open(settings_path, 'r') as f:
+        settings = json.load(f)
+    return settings if settings.get('backend') in AUTOTUNE_BACKENDS else None
+
+def apply_inference_settings(settings):
+    """Apply tuned thread counts to this process and log the chosen configuration"""
+    torch.set_num_threads(settings['threads'])
+    try:
+        torch.set_num_interop_threads(settings['interop_threads'])
+    except RuntimeError:
+        # Can only be set once per process, before any inter-op work has started
+        pass
+    logger.info(
+        "Inference settings for %s: backend=%s threads=%d interop_threads=%d batch_size=%d (%.2f ms/text)",
+        settings['host'], settings['backend'], settings['threads'], torch.get_num_interop_threads(),
+        settings['batch_size'], settings['ms_per_text']
+    )
+
+# ======================
+# INFERENCE RESULT CACHE
+# ======================
+class InferenceResultCache:
+    """
+    Thread-safe cache of emotion results keyed by a hash of the cleaned text,
+    model version and top_k
+    
+    Entries live in a bounded in-memory LRU and, when disk_dir is set, in one
+    JSON file per key on disk, capped at disk_max_entries by evicting the files
+    with the oldest mtime (refreshed on every disk hit). Concurrent requests for
+    a key that is already being computed wait for that computation instead of
+    running their own.
+    """
+    
+    def __init__(self, max_entries=RESULT_CACHE_SIZE, disk_dir=None, disk_max_entries=RESULT_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        # Files on disk as last counted plus files written since; None until the first write
+        self._disk_count = None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'coalesced': 0, 'misses': 0, 'disk_evictions': 0}
+    
+    @staticmethod
+    def make_key(text, model_version, top_k, mode='truncate'):
+        return hashlib.sha256(f"{model_version}\0{top_k}\0{mode}\0{text}".encode()).hexdigest()
+    
+    def _disk_path(self, key):
+        return self.disk_dir / key[:2] / f"{key}.json"
+    
+    def _disk_files(self):
+        return list(self.disk_dir.glob("??/*.json"))
+    
+    def _read_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+    
+    def _write_disk(self, key, value):
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(temp_path, 'w') as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        with self._disk_lock:
+            if self._disk_count is None:
+                self._disk_count = len(self._disk_files())
+            else:
+                self._disk_count += 1
+            if self._disk_count > self.disk_max_entries:
+                self._sweep_disk()
+    
+    def _sweep_disk(self):
+        """Delete the oldest files down to 90% of the cap; caller must hold the disk lock"""
+        files = []
+        for path in self._disk_files():
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                pass
+        files.sort()
+        excess = len(files) - int(self.disk_max_entries * 0.9)
+        removed = 0
+        for _, path in files[:max(excess, 0)]:
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        # Re-counting each sweep also picks up files written or removed by other processes
+        self._disk_count = len(files) - removed
+        with self._lock:
+            self.stats['disk_evictions'] += removed
+    
+    def _remember(self, key, value):
+        """Insert into the LRU; caller must hold the lock"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get_many(self, keys, compute, cacheable=None):
+        """
+        Return {key: result} for the given keys
+        
+        compute(missing_keys) is called at most once, with only the keys that are
+        neither cached nor already being computed by another thread, and must
+        return {key: result} for them. Computed results for which cacheable(result)
+        is false are returned (and shared with waiting threads) but not stored.
+        """
+        results = {}
+        owned = {}
+        waiting = {}
+        
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    results[key] = self._entries[key]
+                    self.stats['memory_hits'] += 1
+                elif key in self._in_flight:
+                    waiting[key] = self._in_flight[key]
+                    self.stats['coalesced'] += 1
+                else:
+                    owned[key] = Future()
+                    self._in_flight[key] = owned[key]
+        
+        missing = []
+        try:
+            for key in owned:
+                value = self._read_disk(key)
+                if value is None:
+                    missing.append(key)
+                else:
+                    results[key] = value
+            if missing:
+                results.update(compute(missing))
+        except BaseException as e:
+            with self._lock:
+                for key, future in owned.items():
+                    del self._in_flight[key]
+                    future.set_exception(e)
+            raise
+        
+        skipped = set() if cacheable is None else {key for key in missing if not cacheable(results[key])}
+        
+        with self._lock:
+            self.stats['disk_hits'] += len(owned) - len(missing)
+            self.stats['misses'] += len(missing)
+            for key, future in owned.items():
+                if key not in skipped:
+                    self._remember(key, results[key])
+                del self._in_flight[key]
+                future.set_result(results[key])
+        
+        for key in missing:
+            if key not in skipped:
+                self._write_disk(key, results[key])
+        
+        for key, future in waiting.items():
+            results[key] = future.result()
+        
+        return results
+    
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        hits = stats['memory_hits'] + stats['disk_hits'] + stats['coalesced']
+        total = hits + stats['misses']
+        stats['hit_rate'] = hits / total if total else 0.0
+        return stats
+
+@st.cache_resource
+def get_result_cache():
+    """Process-wide inference result cache shared by all sessions"""
+    return InferenceResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR)
+
+# ======================
+# MICRO-BATCHING WORKER
+# ======================
+class MicroBatchInferenceWorker:
+    """
+    Background thread that owns the model and serves requests from all sessions
+    
+    Requests are queued and collected into one micro-batch until either
+    max_batch_size texts are waiting or max_wait_ms has passed since the first
+    request arrived. Each caller gets its results through a Future.
+    """
+    
+    def __init__(self, model, tokenizer, emotion_labels, embedding_store, max_batch_size=INFERENCE_BATCH_SIZE, max_wait_ms=MICRO_BATCH_WAIT_MS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.emotion_labels = emotion_labels
+        self.embedding_store = embedding_store
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self.stats = {'requests': 0, 'batches': 0, 'texts': 0}
+        self._thread = threading.Thread(target=self._run, name="emotion-inference-worker", daemon=True)
+        self._thread.start()
+    
+    def submit(self, texts, top_k=5, long_text=False):
+        """Queue cleaned, non-empty texts and return a Future of their result lists"""
+        future = Future()
+        self._queue.put((list(texts), top_k, long_text, future))
+        return future
+    
+    def _collect_batch(self):
+        requests = [self._queue.get()]
+        size = len(requests[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+    
+    def _run(self):
+        while True:
+            requests = self._collect_batch()
+            try:
+                self.stats['requests'] += len(requests)
+                for long_text in (False, True):
+                    group = [request for request in requests if request[2] == long_text]
+                    if group:
+                        self._process(group, long_text)
+            except Exception as e:
+                # Keep the worker alive and fail only the requests of this batch
+                logger.exception("Inference worker batch failed")
+                for _, _, _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def _process(self, requests, long_text):
+        texts = [text for request_texts, _, _, _ in requests for text in request_texts]
+        # One forward pass at the largest top_k; smaller requests take a prefix
+        top_k = max(request_top_k for _, request_top_k, _, _ in requests)
+        
+        try:
+            # A single large request can exceed max_batch_size, so the group still runs in micro-batches
+            results = run_emotion_model(
+                texts, self.model, self.tokenizer, self.emotion_labels, top_k, self.max_batch_size, long_text, self.embedding_store
+            )
+        except Exception as e:
+            for _, _, _, future in requests:
+                future.set_exception(e)
+            return
+        
+        self.stats['batches'] += 1
+        self.stats['texts'] += len(texts)
+        
+        offset = 0
+        for request_texts, request_top_k, _, future in requests:
+            request_results = results[offset:offset + len(request_texts)]
+            future.set_result([emotions_data[:request_top_k] for emotions_data in request_results])
+            offset += len(request_texts)
+
+@st.cache_resource
+def get_inference_worker(model_id, _model, _tokenizer, _emotion_labels):
+    """
+    One shared micro-batching worker per loaded model
+    
+    Keyed on id(model) rather than the model version, so a model rebuilt after
+    a failed load gets its own worker. The worker keeps its model alive, which
+    stops the id from being reused while the cached entry exists.
+    """
+    return MicroBatchInferenceWorker(_model, _tokenizer, _emotion_labels, get_embedding_store(), max_batch_size=get_batch_size(_model))
+
+def get_batch_size(model):
+    """Mini-batch size for a model, autotuned when SOUL_AUTOTUNE=1"""
+    return getattr(model, 'batch_size', INFERENCE_BATCH_SIZE)
+
+def get_inference_mode(long_text):
+    """Cache key component for how texts longer than the model window were handled"""
+    return f"window-{LONG_TEXT_AGGREGATION}" if long_text else 'truncate'
+
+def get_model_version(model):
+    """Identifier of the model and backend that produced a prediction"""
+    return getattr(model, 'model_version', MODEL_SOURCE)
+
+def clean_text(text):
+    if pd.isna(text) or text == "":
+        return ""
+    text = ' '.join(text.split())
+    return text.strip()
+
+def predict_emotions_multilabel(text, model, tokenizer, emotion_labels, top_k=5, long_text=False):
+    return predict_emotions_batch([text], model, tokenizer, emotion_labels, top_k=top_k, long_text=long_text)[0]
+
+def split_into_sentences(text, max_sentences=MAX_TIMELINE_SENTENCES):
+    """Split an entry into sentences at terminal punctuation and line breaks"""
+    sentences = re.split(r'(?<=[.!?])\s+|\n+', text)
+    return [sentence.strip() for sentence in sentences if sentence.strip()][:max_sentences]
+
+def predict_sentence_timeline(text, model, tokenizer, emotion_labels, top_k=5):
+    """
+    Classify an entry and each of its sentences in one batched call
+    
+    Returns the document-level emotions and a list of {'sentence', 'emotions'}
+    dicts in reading order. Both go through the result cache, so the
+    document result is shared with predict_emotions_multilabel and reruns
+    only recompute sentences that weren't seen before.
+    """
+    sentences = split_into_sentences(text)
+    results = predict_emotions_batch([text] + sentences, model, tokenizer, emotion_labels, top_k=top_k, long_text=True)
+    timeline = [
+        {'sentence': sentence, 'emotions': emotions_data}
+        for sentence, emotions_data in zip(sentences, results[1:])
+        if emotions_data
+    ]
+    return results[0], timeline
+
+def predict_emotions_batch(texts, model, tokenizer, emotion_labels, top_k=5, batch_size=None, use_cache=True, long_text=False):
+    """
+    Predict emotions for many texts at once, returning one result list per text in input order
+    
+    With long_text=True, texts longer than MAX_SEQUENCE_LENGTH tokens are scored
+    over overlapping windows instead of being truncated to their beginning.
+    """
+    cleaned = [clean_text(text) for text in texts]
+    results = [[] for _ in cleaned]
+
+    pending = [i for i, text in enumerate(cleaned) if text]
+    if not pending:
+        return results
+
+    if not use_cache:
+        computed = classify_texts([cleaned[i] for i in pending], model, tokenizer, emotion_labels, top_k, batch_size, long_text)
+        for i, emotions_data in zip(pending, computed):
+            results[i] = emotions_data
+        return results
+
+    # Identical texts share one cache key, so each distinct text is classified at most once
+    model_version = get_model_version(model)
+    mode = get_inference_mode(long_text)
+    keys = {i: InferenceResultCache.make_key(cleaned[i], model_version, top_k, mode) for i in pending}
+    key_texts = {keys[i]: cleaned[i] for i in pending}
+
+    def compute(missing_keys):
+        computed = classify_texts([key_texts[key] for key in missing_keys], model, tokenizer, emotion_labels, top_k, batch_size, long_text)
+        return dict(zip(missing_keys, computed))
+
+    cached = get_result_cache().get_many(list(key_texts), compute)
+    for i in pending:
+        # Hand out copies so callers can't modify the shared cached results
+        results[i] = [dict(emotion) for emotion in cached[keys[i]]]
+
+    return results
+
+def classify_texts(texts, model, tokenizer, emotion_labels, top_k=5, batch_size=None, long_text=False):
+    """
+    Classify cleaned texts, sharing forward passes with other sessions when possible
+    
+    Small requests go through the shared micro-batching worker. Requests that
+    already fill a batch on their own run directly in the calling thread, as do
+    requests the worker hasn't answered within INFERENCE_WORKER_TIMEOUT seconds.
+    """
+    batch_size = batch_size or get_batch_size(model)
+    if INFERENCE_WORKER_ENABLED and len(texts) < batch_size:
+        worker = get_inference_worker(id(model), model, tokenizer, emotion_labels)
+        try:
+            return worker.submit(texts, top_k, long_text).result(timeout=INFERENCE_WORKER_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning("Inference worker did not answer within %.0fs, classifying directly", INFERENCE_WORKER_TIMEOUT)
+    return run_emotion_model(texts, model, tokenizer, emotion_labels, top_k, batch_size, long_text)
+
+def run_emotion_model(texts, model, tokenizer, emotion_labels, top_k=5, batch_size=None, long_text=False, embedding_store=None):
+    """
+    Run the classifier over already-cleaned, non-empty texts in length-sorted mini-batches
+    
+    Background threads pass embedding_store explicitly; script runs use the process-wide one.
+    """
+    probabilities, embeddings = compute_emotion_probabilities(texts, model, tokenizer, batch_size, long_text, return_embeddings=True)
+    if embeddings is not None:
+        remember_embeddings(texts, embeddings, model, long_text, embedding_store)
+    return build_emotion_results_batch(probabilities, emotion_labels, top_k)
+
+def compute_emotion_probabilities(texts, model, tokenizer, batch_size=None, long_text=False, return_embeddings=False):
+    """
+    Return a (len(texts), num_labels) tensor of class probabilities
+    
+    With return_embeddings=True, returns (probabilities, embeddings) where
+    embeddings are the pooled features from the same forward pass, or None
+    when the backend can't provide them.
+    """
+    if long_text:
+        sequences, owners = split_into_windows(texts, tokenizer)
+    else:
+        sequences = tokenizer(texts, truncation=True, max_length=MAX_SEQUENCE_LENGTH)['input_ids']
+        owners = list(range(len(texts)))
+
+    if return_embeddings:
+        sequence_probs, sequence_embeddings = run_sequences(sequences, model, tokenizer, batch_size, return_embeddings=True)
+    else:
+        sequence_probs, sequence_embeddings = run_sequences(sequences, model, tokenizer, batch_size), None
+    if not long_text:
+        return (sequence_probs, sequence_embeddings) if return_embeddings else sequence_probs
+
+    # Every window of a document was scored in the same batched pass; combine them per document
+    owners = torch.tensor(owners)
+    window_counts = torch.bincount(owners, minlength=len(texts)).unsqueeze(1)
+    if LONG_TEXT_AGGREGATION == 'max':
+        document_probs = torch.zeros(len(texts), sequence_probs.shape[1]).scatter_reduce(
+            0, owners.unsqueeze(1).expand_as(sequence_probs), sequence_probs, reduce='amax', include_self=False
         )
-        user_data['last_checkin_date'] = today.isoformat()
     else:
-        # Missed a day - reset to 1
-        user_data['streak_count'] = 1
-        user_data['last_checkin_date'] = today.isoformat()
+        document_probs = torch.zeros(len(texts), sequence_probs.shape[1]).index_add(0, owners, sequence_probs) / window_counts
+    
+    if not return_embeddings:
+        return document_probs
+    document_embeddings = None
+    if sequence_embeddings is not None:
+        document_embeddings = torch.zeros(len(texts), sequence_embeddings.shape[1]).index_add(0, owners, sequence_embeddings) / window_counts
+    return document_probs, document_embeddings
+
+def run_sequences(sequences, model, tokenizer, batch_size=None, return_embeddings=False):
+    """Classify token id sequences in length-sorted, dynamically padded mini-batches"""
+    batch_size = batch_size or get_batch_size(model)
+    # Length-sorted batches keep similarly sized texts together so little padding is wasted,
+    # and each mini-batch is padded only to its own longest sequence
+    order = sorted(range(len(sequences)), key=lambda j: len(sequences[j]))
+    probabilities = [None] * len(sequences)
+    
+    head = get_embedding_head(model) if return_embeddings else None
+    capture = getattr(head, 'embedding_capture', None)
+    embeddings = [None] * len(sequences) if capture is not None else None
+
+    device = model.device
+    model.eval()
+    if capture is not None:
+        capture.active = True
+    try:
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            inputs = tokenizer.pad(
+                {'input_ids': [sequences[j] for j in batch]},
+                return_tensors="pt"
+            ).to(device)
+
+            with torch.no_grad():
+                outputs = model(**inputs)
+                predictions = torch.nn.functional.softmax(outputs.logits.float(), dim=-1).cpu()
+
+            for row, j in enumerate(batch):
+                probabilities[j] = predictions[row]
+                if embeddings is not None:
+                    embeddings[j] = capture.features[row]
+    finally:
+        if capture is not None:
+            capture.active = False
+
+    probabilities = torch.stack(probabilities)
+    if not return_embeddings:
+        return probabilities
+    return probabilities, (torch.stack(embeddings) if embeddings is not None else None)
+
+def split_into_windows(texts, tokenizer, max_windows=LONG_TEXT_MAX_WINDOWS):
+    """
+    Split each text's tokens into overlapping model-sized windows
     
-    users[username] = user_data
-    save_users(users)
+    Returns the window token id sequences and, for each window, the index of
+    the text it came from. Texts that need more than max_windows windows keep
+    an evenly spaced subset, so the start, middle and end are all covered while
+    the cost per document stays bounded.
+    """
+    # Leave room for RoBERTa's <s> ... </s> around every window
+    window_size = MAX_SEQUENCE_LENGTH - 2
+    step = window_size - LONG_TEXT_WINDOW_OVERLAP
+    token_ids = tokenizer(texts, add_special_tokens=False)['input_ids']
 
-def add_xp(username, amount):
-    """Add XP and level up user"""
-    users = load_users()
-    if username not in users:
-        return
+    sequences = []
+    owners = []
+    for index, ids in enumerate(token_ids):
+        if len(ids) <= window_size:
+            starts = [0]
+        else:
+            window_count = -(-(len(ids) - window_size) // step) + 1
+            starts = [min(i * step, len(ids) - window_size) for i in range(window_count)]
+            if window_count > max_windows:
+                keep = np.unique(np.linspace(0, window_count - 1, max_windows).round().astype(int))
+                starts = [starts[i] for i in keep]
+
+        for start in starts:
+            sequences.append([tokenizer.cls_token_id] + ids[start:start + window_size] + [tokenizer.sep_token_id])
+            owners.append(index)
+
+    return sequences, owners
+
+@functools.lru_cache(maxsize=8)
+def get_label_metadata(emotion_labels):
+    """MENTAL_HEALTH_MAPPING as numpy arrays aligned with the model's label order (emotion_labels is a tuple)"""
+    mappings = [MENTAL_HEALTH_MAPPING.get(emotion, {}) for emotion in emotion_labels]
+    risk_levels = np.array([m.get('risk_level', 'low') for m in mappings], dtype=object)
+    return {
+        'labels': np.array(emotion_labels, dtype=object),
+        'risk_levels': risk_levels,
+        'risk_weights': np.array([RISK_WEIGHTS[level] for level in risk_levels], dtype=np.float32),
+        'concerns': np.array([m.get('concern', 'unknown') for m in mappings], dtype=object),
+        'colors': np.array([m.get('color', 'gray') for m in mappings], dtype=object)
+    }
+
+def score_probability_matrix(probabilities, emotion_labels, top_k=5):
+    """
+    Compute top-k emotions and risk scores for a whole (texts, labels) probability matrix
     
-    user_data = users[username]
+    Returns arrays with one row per text: top-k label indices, names,
+    confidences, risk levels, concerns and colors, plus one risk score per text
+    computed exactly as calculate_risk_score does over the top-k emotions.
+    """
+    metadata = get_label_metadata(tuple(emotion_labels))
+    top_probs, top_indices = torch.topk(torch.as_tensor(probabilities), k=min(top_k, len(emotion_labels)), dim=-1)
+    top_probs = top_probs.numpy()
+    top_indices = top_indices.numpy()
+
+    confidence_sum = top_probs.sum(axis=1)
+    weighted_sum = (metadata['risk_weights'][top_indices] * top_probs).sum(axis=1)
+    max_score = RISK_WEIGHTS['high'] * confidence_sum
+    risk_scores = np.divide(weighted_sum * 100, max_score, out=np.zeros_like(weighted_sum), where=max_score > 0)
+
+    return {
+        'indices': top_indices,
+        'labels': metadata['labels'][top_indices],
+        'confidences': top_probs,
+        'risk_levels': metadata['risk_levels'][top_indices],
+        'concerns': metadata['concerns'][top_indices],
+        'colors': metadata['colors'][top_indices],
+        'risk_scores': risk_scores
+    }
+
+def build_emotion_results_batch(probabilities, emotion_labels, top_k=5):
+    """Turn a matrix of class probabilities into the top-k emotion result dicts for each row"""
+    scored = score_probability_matrix(probabilities, emotion_labels, top_k)
+    rows = zip(
+        scored['labels'].tolist(),
+        scored['confidences'].tolist(),
+        scored['risk_levels'].tolist(),
+        scored['concerns'].tolist(),
+        scored['colors'].tolist()
+    )
+    return [
+        [
+            {'emotion': emotion, 'confidence': confidence, 'risk_level': risk_level, 'concern': concern, 'color': color}
+            for emotion, confidence, risk_level, concern, color in zip(*row)
+        ]
+        for row in rows
+    ]
+
+def calculate_risk_score(emotions_data):
+    risk_weights = RISK_WEIGHTS
+    total_score = sum(risk_weights[e['risk_level']] * e['confidence'] for e in emotions_data)
+    max_score = sum(risk_weights['high'] * e['confidence'] for e in emotions_data)
     
-    if 'mind_gym' not in user_data:
-        user_data['mind_gym'] = {'xp': 0, 'level': 1, 'completed_tasks': []}
+    if max_score == 0:
+        return 0
     
-    user_data['mind_gym']['xp'] += amount
+    return (total_score / max_score) * 100
+
+# ======================
+# SIMILAR ENTRIES
+# ======================
+class EmbeddingStore:
+    """Thread-safe LRU of text embeddings captured during classification"""
+    
+    def __init__(self, max_entries=EMBEDDING_STORE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(text, model_version, mode):
+        return hashlib.sha256(f"{model_version}\0embedding\0{mode}\0{text}".encode()).hexdigest()
+    
+    def put_many(self, items):
+        with self._lock:
+            for key, embedding in items:
+                self._entries[key] = embedding
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def get(self, key):
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+            return embedding
+
+@st.cache_resource
+def get_embedding_store():
+    """Process-wide store of embeddings from recent forward passes"""
+    return EmbeddingStore()
+
+def remember_embeddings(texts, embeddings, model, long_text, store=None):
+    """Keep float16 embeddings from a forward pass so callers can pick them up without recomputing"""
+    if store is None:
+        store = get_embedding_store()
+    model_version = get_model_version(model)
+    mode = get_inference_mode(long_text)
+    embeddings = embeddings.numpy().astype(np.float16)
+    store.put_many(
+        (EmbeddingStore.make_key(text, model_version, mode), embedding)
+        for text, embedding in zip(texts, embeddings)
+    )
+
+def get_text_embedding(text, model, tokenizer, long_text=False):
+    """
+    float16 embedding of a text that was just classified, or None if the backend has none
     
-    # Level up every 100 XP
-    new_level = (user_data['mind_gym']['xp'] // 100) + 1
-    user_data['mind_gym']['level'] = new_level
+    The embedding normally comes from the store filled by the prediction's
+    own forward pass. Only when the prediction was served from the result
+    cache does this run the model once more.
+    """
+    cleaned = clean_text(text)
+    if not cleaned or get_embedding_head(model) is None:
+        return None
     
-    users[username] = user_data
-    save_users(users)
+    key = EmbeddingStore.make_key(cleaned, get_model_version(model), get_inference_mode(long_text))
+    embedding = get_embedding_store().get(key)
+    if embedding is None:
+        _, embeddings = compute_emotion_probabilities([cleaned], model, tokenizer, 1, long_text, return_embeddings=True)
+        remember_embeddings([cleaned], embeddings, model, long_text)
+        embedding = embeddings[0].numpy().astype(np.float16)
+    return embedding
 
-def load_gratitude_entries(username):
-    """Load user's gratitude journal entries"""
-    gratitude_file = Path("gratitude.json")
-    if gratitude_file.exists():
-        try:
-            with open(gratitude_file, 'r') as f:
-                all_entries = json.load(f)
-                return all_entries.get(username, [])
-        except:
-            return []
-    return []
+def encode_embedding(embedding):
+    """Compact JSON-safe form of a float16 embedding"""
+    return base64.b64encode(np.asarray(embedding, dtype=np.float16).tobytes()).decode('ascii')
 
-def save_gratitude_entry(username, entry):
-    """Save a gratitude journal entry"""
-    gratitude_file = Path("gratitude.json")
+def decode_embedding(value):
+    return np.frombuffer(base64.b64decode(value), dtype=np.float16)
+
+class EmbeddingIndex:
+    """
+    In-process nearest-neighbour index over normalized embeddings
     
-    if gratitude_file.exists():
-        try:
-            with open(gratitude_file, 'r') as f:
-                all_entries = json.load(f)
-        except:
-            all_entries = {}
-    else:
-        all_entries = {}
+    Small collections are searched exactly with one matrix-vector product.
+    From EMBEDDING_IVF_MIN_ENTRIES on, vectors are partitioned with k-means
+    (about sqrt(n) lists) and a query only scans the EMBEDDING_IVF_PROBES
+    lists whose centroids are closest.
+    """
     
-    if username not in all_entries:
-        all_entries[username] = []
+    def __init__(self, ids, embeddings):
+        self.ids = list(ids)
+        self.vectors = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        self.centroids = None
+        self.lists = None
+        if len(self.ids) >= EMBEDDING_IVF_MIN_ENTRIES:
+            self._build_ivf()
+    
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def _build_ivf(self, iterations=10):
+        n_lists = int(np.sqrt(len(self.vectors)))
+        rng = np.random.default_rng(0)
+        # Train the centroids on a sample; assigning every vector afterwards is one matrix product
+        sample = self.vectors[rng.choice(len(self.vectors), min(len(self.vectors), n_lists * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = (sample @ centroids.T).argmax(axis=1)
+            for list_index in range(n_lists):
+                members = sample[assignment == list_index]
+                if len(members):
+                    centroids[list_index] = members.mean(axis=0)
+            centroids = self._normalize(centroids)
+        
+        self.centroids = centroids
+        assignment = (self.vectors @ centroids.T).argmax(axis=1)
+        self.lists = [np.flatnonzero(assignment == list_index) for list_index in range(n_lists)]
+    
+    def add(self, entry_id, embedding):
+        vector = self._normalize(np.asarray(embedding, dtype=np.float32))
+        self.ids.append(entry_id)
+        self.vectors = np.vstack([self.vectors, vector[None, :]]) if len(self.vectors) else vector[None, :]
+        if self.centroids is not None:
+            list_index = int((self.centroids @ vector).argmax())
+            self.lists[list_index] = np.append(self.lists[list_index], len(self.ids) - 1)
+    
+    def search(self, embedding, k=5, exclude=()):
+        """Return up to k (id, cosine similarity) pairs, most similar first"""
+        if not self.ids:
+            return []
+        query = self._normalize(np.asarray(embedding, dtype=np.float32))
+        
+        if self.centroids is None:
+            candidates = np.arange(len(self.ids))
+        else:
+            probes = np.argsort(-(self.centroids @ query))[:EMBEDDING_IVF_PROBES]
+            candidates = np.concatenate([self.lists[list_index] for list_index in probes])
+        
+        excluded = set(exclude)
+        if excluded:
+            candidates = np.array([c for c in candidates if self.ids[c] not in excluded], dtype=int)
+        if len(candidates) == 0:
+            return []
+        
+        scores = self.vectors[candidates] @ query
+        top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[candidates[i]], float(scores[i])) for i in top]
+
+def get_history_index(model_version):
+    """
+    Index over the session's emotion history entries embedded by model_version
     
-    all_entries[username].append({
-        'entry': entry,
-        'timestamp': datetime.now().isoformat()
-    })
+    The index is kept in session state and extended with new entries as they
+    are added, so it is only rebuilt when the history is replaced.
+    """
+    history = st.session_state.emotion_history
+    
+    def embedded(entries, offset=0):
+        return [
+            (offset + i, entry['embedding']) for i, entry in enumerate(entries)
+            if entry.get('embedding_model') == model_version and entry.get('embedding') is not None
+        ]
+    
+    cached = st.session_state.get('embedding_index')
+    if cached is None or cached['model_version'] != model_version or cached['history_id'] != id(history) or cached['scanned'] > len(history):
+        entries = embedded(history)
+        index = EmbeddingIndex(*zip(*entries)) if entries else EmbeddingIndex([], np.zeros((0, 0)))
+        cached = {'model_version': model_version, 'history_id': id(history), 'scanned': len(history), 'index': index}
+        st.session_state.embedding_index = cached
+    
+    for i, embedding in embedded(history[cached['scanned']:], cached['scanned']):
+        cached['index'].add(i, embedding)
+    cached['scanned'] = len(history)
+    return cached['index']
+
+def find_similar_entries(embedding, model_version, k=3, exclude=()):
+    """
+    Most similar past emotion history entries as (entry, similarity) pairs
     
-    try:
-        with open(gratitude_file, 'w') as f:
-            json.dump(all_entries, f, indent=2)
-    except Exception as e:
-        st.error(f"Error saving gratitude entry: {str(e)}")
+    Entries with the same text and timestamp count once, and copies of
+    excluded entries are skipped too; older histories stored every analysis twice.
+    """
+    if embedding is None:
+        return []
+    index = get_history_index(model_version)
+    history = st.session_state.emotion_history
+    seen = {(history[i]['text'], str(history[i]['timestamp'])) for i in exclude}
+    similar = []
+    for i, similarity in index.search(embedding, 2 * k, exclude):
+        identity = (history[i]['text'], str(history[i]['timestamp']))
+        if identity not in seen:
+            seen.add(identity)
+            similar.append((history[i], similarity))
+    return similar[:k]
 
-@st.cache_resource(show_spinner=False)
-def load_model():
-    """Load model from Hugging Face Hub"""
-    try:
-        with st.spinner("🔄 Loading AI model from Hugging Face... This may take a minute on first load."):
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            
-            # Load model and tokenizer directly from Hugging Face
-            model = RobertaForSequenceClassification.from_pretrained(
-                HUGGINGFACE_MODEL_NAME,
-                trust_remote_code=True
-            ).to(device)
-            
-            tokenizer = RobertaTokenizer.from_pretrained(
-                HUGGINGFACE_MODEL_NAME,
-                trust_remote_code=True
-            )
-            
-            # Use default emotion labels if not available
-            emotion_labels = list(MENTAL_HEALTH_MAPPING.keys())
-            
-            return model, tokenizer, emotion_labels
-            
-    except Exception as e:
-        st.error(f"❌ Error loading model from Hugging Face: {str(e)}")
-        st.info(f"Please ensure '{HUGGINGFACE_MODEL_NAME}' is a valid Hugging Face model repository.")
-        st.info("Make sure your model is public or you have the correct access permissions.")
-        return None, None, None
+def display_similar_entries(similar_entries):
+    """Show past entries with their date, primary emotion and similarity"""
+    for entry, similarity in similar_entries:
+        timestamp = entry['timestamp']
+        date = timestamp.strftime('%Y-%m-%d %H:%M') if isinstance(timestamp, datetime) else str(timestamp)
+        excerpt = entry['text'] if len(entry['text']) <= 160 else entry['text'][:160] + "..."
+        primary = entry['emotions'][0] if entry.get('emotions') else None
+        st.markdown(f"**{date}** — {excerpt}")
+        st.caption(
+            (f"{primary['emotion'].title()} ({primary['confidence']*100:.1f}%) · " if primary else "")
+            + f"{similarity*100:.0f}% similar"
+        )
 
-def initialize_hf_chatbot():
-    """Initialize Hugging Face chatbot client"""
-    try:
-        client = Client("SENTIBOT2705/mentalhealthbot-phi2")
-        return client
-    except Exception as e:
-        st.error(f"Failed to initialize chatbot: {str(e)}")
+# ======================
+# EXPLANATIONS
+# ======================
+@st.cache_resource
+def get_explanation_cache():
+    """Process-wide cache of word attributions, persisted next to the result cache when configured"""
+    disk_dir = Path(RESULT_CACHE_DIR) / "explanations" if RESULT_CACHE_DIR else None
+    return InferenceResultCache(EXPLANATION_CACHE_SIZE, disk_dir, EXPLANATION_CACHE_DISK_MAX_ENTRIES)
+
+def explain_top_emotion(text, model, tokenizer, emotion_labels, label_index, time_budget=EXPLANATION_TIME_BUDGET):
+    """
+    Attribute one emotion's probability to the words of a text by occlusion
+    
+    label_index is the emotion shown to the user, which for long entries comes
+    from window aggregation and can differ from the top label of the explained
+    first MAX_SEQUENCE_LENGTH tokens. Each word is masked in turn and the drop
+    in that emotion's probability is its attribution; negative values mean the
+    word argued against it. The perturbed inputs run in the usual length-sorted
+    batches and work stops once time_budget seconds are spent, leaving later
+    words unscored. Every input is scored by the last plain classifier inside
+    a cascade or early-exit wrapper, so a drop never mixes in a switch of
+    stage or exit depth. Complete results are cached by text, model version,
+    stage, label and budget; partial ones are recomputed next time.
+    """
+    cleaned = clean_text(text)
+    if not cleaned:
         return None
+    
+    stages = get_model_stages(model)
+    stage_version = f"{get_model_version(model)}/stage-{len(stages) - 1}"
+    key = InferenceResultCache.make_key(cleaned, stage_version, f"explain-{label_index}", f"occlusion-{time_budget}")
+    
+    def compute(missing_keys):
+        return {missing_keys[0]: compute_occlusion_attributions(cleaned, stages[-1], tokenizer, emotion_labels, label_index, time_budget)}
+    
+    return get_explanation_cache().get_many([key], compute, cacheable=lambda explanation: explanation['complete'])[key]
 
-@st.cache_resource
-def get_chatbot_client():
-    return initialize_hf_chatbot()
+def compute_occlusion_attributions(text, model, tokenizer, emotion_labels, label_index, time_budget):
+    """Word-occlusion attributions for a cleaned text; see explain_top_emotion"""
+    start_time = time.perf_counter()
+    if tokenizer.is_fast:
+        encoding = tokenizer(text, truncation=True, max_length=MAX_SEQUENCE_LENGTH, return_offsets_mapping=True)
+        input_ids = encoding['input_ids']
+        # Occlude whole words so the explanation reads in the user's own words rather than subword pieces
+        words = {}
+        for position, word_id in enumerate(encoding.word_ids()):
+            if word_id is not None:
+                words.setdefault(word_id, []).append(position)
+        word_positions = list(words.values())
+        offsets = encoding['offset_mapping']
+        word_texts = []
+        previous_end = 0
+        for positions in word_positions:
+            start, end = offsets[positions[0]][0], offsets[positions[-1]][1]
+            # Keep the original spacing so the rendered text reads like the entry
+            word_texts.append((text[previous_end:start], text[start:end]))
+            previous_end = end
+    else:
+        # Slow tokenizers have no word alignment, so each subword token is its own unit
+        input_ids = tokenizer(text, truncation=True, max_length=MAX_SEQUENCE_LENGTH)['input_ids']
+        special_ids = set(tokenizer.all_special_ids)
+        word_positions = [[position] for position, token_id in enumerate(input_ids) if token_id not in special_ids]
+        word_texts = []
+        for positions in word_positions:
+            token = tokenizer.decode([input_ids[positions[0]]])
+            word_texts.append((token[:len(token) - len(token.lstrip())], token.lstrip()))
+    mask_id = tokenizer.mask_token_id if tokenizer.mask_token_id is not None else tokenizer.unk_token_id
+    
+    def occluded(positions):
+        sequence = list(input_ids)
+        for position in positions:
+            sequence[position] = mask_id
+        return sequence
+    
+    baseline = run_sequences([input_ids], model, tokenizer, 1)[0]
+    
+    attributions = [None] * len(word_positions)
+    batch_size = get_batch_size(model)
+    for batch_start in range(0, len(word_positions), batch_size):
+        if time.perf_counter() - start_time > time_budget:
+            break
+        batch = range(batch_start, min(batch_start + batch_size, len(word_positions)))
+        probabilities = run_sequences([occluded(word_positions[i]) for i in batch], model, tokenizer, batch_size)
+        drops = baseline[label_index] - probabilities[:, label_index]
+        for i, drop in zip(batch, drops.tolist()):
+            attributions[i] = drop
+    
+    return {
+        'emotion': emotion_labels[label_index],
+        'confidence': float(baseline[label_index]),
+        'words': [
+            {'prefix': prefix, 'word': word, 'attribution': attribution}
+            for (prefix, word), attribution in zip(word_texts, attributions)
+        ],
+        'complete': all(attribution is not None for attribution in attributions),
+        'truncated': len(input_ids) >= MAX_SEQUENCE_LENGTH,
+        'seconds': time.perf_counter() - start_time
+    }
 
-def clean_text(text):
-    if pd.isna(text) or text == "":
-        return ""
-    text = ' '.join(text.split())
-    return text.strip()
+def render_attributions(explanation):
+    """HTML for the explained text with words shaded by how much they pushed towards the top emotion"""
+    scored = [abs(word['attribution']) for word in explanation['words'] if word['attribution'] is not None]
+    scale = max(scored) if scored and max(scored) > 0 else 1.0
+    
+    spans = []
+    for word in explanation['words']:
+        attribution = word['attribution']
+        if attribution is None:
+            style = "color: #9ca3af;"
+        else:
+            alpha = min(abs(attribution) / scale, 1.0) * 0.6
+            rgb = "235, 51, 73" if attribution > 0 else "56, 239, 125"
+            style = f"background: rgba({rgb}, {alpha:.2f}); border-radius: 4px; padding: 0 2px;"
+        title = "" if attribution is None else f" title='{attribution*100:+.1f} pts'"
+        spans.append(f"{html.escape(word['prefix'])}<span style='{style}'{title}>{html.escape(word['word'])}</span>")
+    return f"<div style='line-height: 2;'>{''.join(spans)}</div>"
 
-def predict_emotions_multilabel(text, model, tokenizer, emotion_labels, top_k=5):
-    text = clean_text(text)
-    if not text:
-        return []
+# ======================
+# SOCIAL MEDIA HELPERS
+# ======================
+SOCIAL_MEDIA_RESULT_COLUMNS = ['text', 'primary_emotion', 'confidence', 'risk_score', 'risk_level', 'full_text']
+
+def analyze_social_media_chunk(raw_texts, model, tokenizer, emotion_labels):
+    """Classify one chunk of CSV texts as a single batch and build the per-row results as a DataFrame"""
+    texts = pd.Series([clean_text(str(value)) for value in raw_texts], dtype=object)
+    rows = pd.DataFrame({
+        'text': '[Empty or invalid text]',
+        'primary_emotion': 'N/A',
+        'confidence': 0.0,
+        'risk_score': 0.0,
+        'risk_level': 'N/A',
+        'full_text': ''
+    }, index=range(len(texts)), columns=SOCIAL_MEDIA_RESULT_COLUMNS)
+    
+    valid = (texts != '').to_numpy()
+    if valid.any():
+        valid_texts = texts[valid]
+        # Duplicate posts within a chunk are classified once
+        codes, unique_texts = pd.factorize(valid_texts)
+        probabilities = compute_emotion_probabilities(list(unique_texts), model, tokenizer, long_text=True)
+        scored = score_probability_matrix(probabilities, emotion_labels, top_k=5)
+        
+        rows.loc[valid, 'text'] = np.where(valid_texts.str.len() > 100, valid_texts.str.slice(0, 100) + '...', valid_texts)
+        rows.loc[valid, 'primary_emotion'] = scored['labels'][codes, 0]
+        rows.loc[valid, 'confidence'] = scored['confidences'][codes, 0]
+        rows.loc[valid, 'risk_score'] = scored['risk_scores'][codes]
+        rows.loc[valid, 'risk_level'] = scored['risk_levels'][codes, 0]
+        rows.loc[valid, 'full_text'] = valid_texts.to_numpy()
+    
+    return rows
+
+def update_social_media_summary(summary, rows):
+    """Fold a chunk of result rows into the running aggregates"""
+    risk_scores = rows['risk_score']
+    confidences = rows['confidence']
+    
+    summary['total'] += len(rows)
+    summary['risk_sum'] += float(risk_scores[risk_scores > 0].sum())
+    summary['risk_count'] += int((risk_scores > 0).sum())
+    summary['high_risk_count'] += int((risk_scores > 66).sum())
+    summary['confidence_sum'] += float(confidences[confidences > 0].sum())
+    summary['confidence_count'] += int((confidences > 0).sum())
+    
+    for column, counts_key in (('primary_emotion', 'emotion_counts'), ('risk_level', 'risk_level_counts')):
+        for value, count in rows.loc[rows[column] != 'N/A', column].value_counts().items():
+            summary[counts_key][value] = summary[counts_key].get(value, 0) + int(count)
+    
+    remaining = SOCIAL_MEDIA_PREVIEW_ROWS - len(summary['preview'])
+    if remaining > 0:
+        summary['preview'].extend(rows.head(remaining).to_dict('records'))
+
+def stream_social_media_csv(csv_file, model, tokenizer, emotion_labels, results_path, chunk_size=CSV_CHUNK_SIZE, on_progress=None):
+    """
+    Analyze a CSV of posts chunk by chunk with bounded memory
     
-    device = next(model.parameters()).device
-    inputs = tokenizer(
-        text,
-        return_tensors="pt",
-        truncation=True,
-        padding=True,
-        max_length=128
-    ).to(device)
+    Each chunk is classified as one batch, appended to the results CSV at
+    results_path and folded into running aggregates. Only the aggregates and
+    the first SOCIAL_MEDIA_PREVIEW_ROWS rows are kept in memory.
+    """
+    summary = {
+        'total': 0,
+        'risk_sum': 0.0,
+        'risk_count': 0,
+        'high_risk_count': 0,
+        'confidence_sum': 0.0,
+        'confidence_count': 0,
+        'emotion_counts': {},
+        'risk_level_counts': {},
+        'preview': []
+    }
     
-    model.eval()
-    with torch.no_grad():
-        outputs = model(**inputs)
-        predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-    
-    top_probs, top_indices = torch.topk(predictions[0], k=min(top_k, len(emotion_labels)))
-    
-    results = []
-    for prob, idx in zip(top_probs, top_indices):
-        emotion = emotion_labels[idx.item()]
-        results.append({
-            'emotion': emotion,
-            'confidence': prob.item(),
-            'risk_level': MENTAL_HEALTH_MAPPING.get(emotion, {}).get('risk_level', 'low'),
-            'concern': MENTAL_HEALTH_MAPPING.get(emotion, {}).get('concern', 'unknown'),
-            'color': MENTAL_HEALTH_MAPPING.get(emotion, {}).get('color', 'gray')
-        })
+    with open(results_path, 'w', newline='', encoding='utf-8') as results_file:
+        for chunk_index, chunk in enumerate(pd.read_csv(csv_file, usecols=['text'], chunksize=chunk_size)):
+            rows = analyze_social_media_chunk(chunk['text'], model, tokenizer, emotion_labels)
+            rows.to_csv(results_file, header=(chunk_index == 0), index=False)
+            update_social_media_summary(summary, rows)
+            
+            if on_progress:
+                on_progress(summary)
     
-    return results
+    return summary
 
-def calculate_risk_score(emotions_data):
-    risk_weights = {'high': 3, 'medium': 2, 'low': 1}
-    total_score = sum(risk_weights[e['risk_level']] * e['confidence'] for e in emotions_data)
-    max_score = sum(risk_weights['high'] * e['confidence'] for e in emotions_data)
-    
-    if max_score == 0:
-        return 0
+def prepare_results_download(results_path, max_mb=SOCIAL_MEDIA_DOWNLOAD_MAX_MB):
+    """
+    Return (path, extension, mime type) of the results export, or None if it is too large
     
-    return (total_score / max_score) * 100
+    Results over max_mb are deflated into a ZIP beside them on disk; the
+    archive is written chunk by chunk, so the CSV is never read into memory.
+    """
+    max_bytes = max_mb * 1024 * 1024
+    if os.path.getsize(results_path) <= max_bytes:
+        return results_path, 'csv', 'text/csv'
+    
+    zip_path = results_path + '.zip'
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(results_path, arcname='social_media_analysis.csv')
+    if os.path.getsize(zip_path) <= max_bytes:
+        return zip_path, 'zip', 'application/zip'
+    os.remove(zip_path)
+    return None
 
 def check_paging_notification():
     if 'last_analysis_time' not in st.session_state:
@@ -1304,12 +4254,10 @@ def generate_pdf_report(username, start_date=None, end_date=None):
     """
     
     # Load user data
-    users = load_users()
-    if username not in users:
+    user_data = load_user_profile(username)
+    if user_data is None:
         return None
     
-    user_data = users[username]
-    
     # Create PDF buffer
     buffer = io.BytesIO()
     
@@ -1738,6 +4686,10 @@ def initialize_session_state():
 
 initialize_session_state()
 
+# Start loading the model in the background as soon as the process serves its first page
+# Same arguments as load_model's call, so both share one cached preloader
+model_preloader = get_model_preloader(MODEL_BACKEND)
+
 # UNAUTHENTICATED SECTION
 if not st.session_state.authenticated:
     
@@ -1918,8 +4870,7 @@ if not st.session_state.authenticated:
                         st.session_state.username = username
                         st.session_state.dass_completed = dass_completed
                         
-                        users = load_users()
-                        st.session_state.dass_results = users[username].get('dass_history', [])
+                        st.session_state.dass_results = load_dass_history(username)
                         
                         if not dass_completed:
                             st.session_state.show_dass_mandatory = True
@@ -2054,16 +5005,24 @@ with col6:
 st.markdown("<div style='margin: 0.5rem 0;'></div>", unsafe_allow_html=True)
 
 if st.session_state.authenticated and st.session_state.username:
-    # Auto-save every time user performs an action
-    # (This will run on every page load/interaction)
-    save_user_session_data(st.session_state.username)
+    # Auto-save on every rerun, but only fields that changed, debounced across quick reruns
+    save_user_session_data(st.session_state.username, immediate=False)
 
-# Load model after authentication
-model, tokenizer, emotion_labels = load_model()
+# Pages that run the classifier render with their actions disabled until the model is ready
+MODEL_PAGES = ('analyze', 'chatbot', 'social_media')
+model, tokenizer, emotion_labels = None, None, None
+model_warming = False
 
-if model is None:
-    st.error("Model not loaded. Please check the model path and try again.")
-    st.stop()
+if st.session_state.current_page in MODEL_PAGES:
+    if not model_preloader.is_ready():
+        model_warming = True
+        show_model_warming_status(model_preloader)
+    else:
+        model, tokenizer, emotion_labels = load_model()
+        
+        if model is None:
+            st.error("Model not loaded. Please check the model path and try again.")
+            st.stop()
 
 # PAGES CONTENT
 st.markdown('<div class="content-container">', unsafe_allow_html=True)
@@ -2144,11 +5103,9 @@ elif st.session_state.current_page == 'analyze':
         </div>
     """, unsafe_allow_html=True)
      # Load user streak data
-    users = load_users()
-    if st.session_state.username in users:
-        user_data = users[st.session_state.username]
-        st.session_state.streak_count = user_data.get('streak_count', 0)
-        st.session_state.longest_streak = user_data.get('longest_streak', 0)
+    streak = get_streak(st.session_state.username)
+    if streak is not None:
+        st.session_state.streak_count, st.session_state.longest_streak = streak
     
     # Display streak
     col_s1, col_s2, col_s3 = st.columns([1, 2, 1])
@@ -2191,11 +5148,13 @@ elif st.session_state.current_page == 'analyze':
         
         col_a, col_b = st.columns(2)
         with col_a:
-            analyze_button = st.button("Analyze Emotions", type="primary", use_container_width=True)
+            analyze_button = st.button("Analyze Emotions", type="primary", use_container_width=True, disabled=model_warming)
         with col_b:
             if st.button("Switch to Chatbot", use_container_width=True):
                 st.session_state.current_page = 'chatbot'
                 st.rerun()
+        
+        sentence_breakdown = st.checkbox("Show sentence-by-sentence breakdown", key="sentence_breakdown")
     
     with col2:
         st.markdown("""
@@ -2213,40 +5172,28 @@ elif st.session_state.current_page == 'analyze':
     
     if analyze_button and user_input:
         with st.spinner("AI is analyzing your emotions..."):
-            emotions_data = predict_emotions_multilabel(user_input, model, tokenizer, emotion_labels, top_k=5)
+            emotions_data = predict_emotions_multilabel(user_input, model, tokenizer, emotion_labels, top_k=5, long_text=True)
             
             if emotions_data:
                 risk_score = calculate_risk_score(emotions_data)
+                # Look up neighbours before this entry joins the history so it can't match itself
+                embedding = get_text_embedding(user_input, model, tokenizer, long_text=True)
+                similar_entries = find_similar_entries(embedding, get_model_version(model))
                 
                 st.session_state.emotion_history.append({
                     'timestamp': datetime.now(),
                     'text': user_input,
                     'emotions': emotions_data,
-                    'risk_score': risk_score
+                    'risk_score': risk_score,
+                    'embedding': embedding,
+                    'embedding_model': get_model_version(model)
                 })
                 st.session_state.analysis_count += 1
                 st.session_state.last_analysis_time = datetime.now()
-
-                if analyze_button and user_input:
-                    with st.spinner("🧠 AI is analyzing your emotions..."):
-                        emotions_data = predict_emotions_multilabel(user_input, model, tokenizer, emotion_labels, top_k=5)
-                        
-                        if emotions_data:
-                            risk_score = calculate_risk_score(emotions_data)
-                            
-                            st.session_state.emotion_history.append({
-                                'timestamp': datetime.now(),
-                                'text': user_input,
-                                'emotions': emotions_data,
-                                'risk_score': risk_score
-                            })
-                            st.session_state.analysis_count += 1
-                            st.session_state.last_analysis_time = datetime.now()
-                            
-                            # ========== ADD THIS LINE ==========
-                            update_streak(st.session_state.username)
-                            # ===================================
-                            
+                # A new analysis starts with its explanation collapsed so it is only computed on request
+                st.session_state.explain_target = {'text': user_input, 'emotion': emotions_data[0]['emotion']}
+                st.session_state.explain_analysis = False
+                update_streak(st.session_state.username)
                 
                 st.markdown("""
                     <div class="section-header">
@@ -2301,6 +5248,73 @@ elif st.session_state.current_page == 'analyze':
                             risk_emoji = "🔴" if emotion['risk_level'] == 'high' else "🟡" if emotion['risk_level'] == 'medium' else "🟢"
                             st.metric("", f"{risk_emoji} {emotion['risk_level'].upper()}", f"{emotion['confidence']*100:.1f}%")
                 
+                if sentence_breakdown:
+                    _, timeline = predict_sentence_timeline(user_input, model, tokenizer, emotion_labels, top_k=5)
+                    
+                    if len(timeline) > 1:
+                        st.markdown("<br><h3 style='color: #1f2937;'>Emotional Timeline</h3>", unsafe_allow_html=True)
+                        
+                        timeline_df = pd.DataFrame([
+                            {
+                                'sentence_number': i,
+                                'sentence': entry['sentence'],
+                                'emotion': entry['emotions'][0]['emotion'],
+                                'confidence': entry['emotions'][0]['confidence'] * 100,
+                                'risk_score': calculate_risk_score(entry['emotions'])
+                            }
+                            for i, entry in enumerate(timeline, 1)
+                        ])
+                        
+                        fig = px.scatter(
+                            timeline_df,
+                            x='sentence_number',
+                            y='risk_score',
+                            color='emotion',
+                            size='confidence',
+                            hover_data={'sentence': True, 'confidence': ':.1f'},
+                            labels={'sentence_number': 'Sentence', 'risk_score': 'Risk Score', 'emotion': 'Primary Emotion'}
+                        )
+                        fig.add_trace(go.Scatter(
+                            x=timeline_df['sentence_number'],
+                            y=timeline_df['risk_score'],
+                            mode='lines',
+                            line=dict(color='#667eea', width=1, dash='dot'),
+                            showlegend=False,
+                            hoverinfo='skip'
+                        ))
+                        fig.update_layout(height=400, plot_bgcolor='white', xaxis=dict(dtick=1))
+                        st.plotly_chart(fig, use_container_width=True)
+                        
+                        with st.expander("Sentence details"):
+                            for i, entry in enumerate(timeline, 1):
+                                top = entry['emotions'][0]
+                                risk_emoji = "🔴" if top['risk_level'] == 'high' else "🟡" if top['risk_level'] == 'medium' else "🟢"
+                                st.markdown(f"**{i}.** {entry['sentence']}")
+                                st.caption(f"{risk_emoji} {top['emotion'].title()} ({top['confidence']*100:.1f}%)")
+                    else:
+                        st.info("Write at least two sentences to see a sentence-by-sentence breakdown.")
+                
+                if similar_entries:
+                    st.markdown("<br><h3 style='color: #1f2937;'>Similar Past Entries</h3>", unsafe_allow_html=True)
+                    display_similar_entries(similar_entries)
+                
+                early_exit_model = model.full_model if isinstance(model, CascadeEmotionClassifier) else model
+                if isinstance(early_exit_model, EarlyExitEmotionClassifier):
+                    exit_stats = early_exit_model.get_stats()
+                    st.caption(
+                        f"Early exit: average depth {exit_stats['average_depth']:.1f} of {early_exit_model.num_layers} layers "
+                        f"({exit_stats['layer_speedup']:.2f}x fewer layer passes)"
+                    )
+                
+                if isinstance(model, CascadeEmotionClassifier):
+                    cascade_stats = model.get_stats()
+                    saved = cascade_stats['seconds_saved']
+                    st.caption(
+                        f"Model cascade: {cascade_stats['escalation_rate']*100:.1f}% of {cascade_stats['sequences']} inputs "
+                        f"escalated to the full model"
+                        + (f", ~{saved:.2f}s of inference time saved" if saved is not None else "")
+                    )
+                
                 st.markdown("<br><h3 style='color: #1f2937;'>Clinical Assessment</h3>", unsafe_allow_html=True)
                 
                 if risk_score > 80:
@@ -2347,6 +5361,28 @@ elif st.session_state.current_page == 'analyze':
                             </ul>
                         </div>
                     """, unsafe_allow_html=True)
+    
+    explain_target = st.session_state.get('explain_target')
+    if explain_target and not model_warming:
+        with st.expander(f"Why {explain_target['emotion'].title()}? Explain the latest analysis"):
+            if st.checkbox("Show which words drove the top emotion", key="explain_analysis"):
+                with st.spinner("Measuring each word's influence..."):
+                    explanation = explain_top_emotion(
+                        explain_target['text'], model, tokenizer, emotion_labels,
+                        list(emotion_labels).index(explain_target['emotion'])
+                    )
+                
+                if explanation:
+                    st.markdown(render_attributions(explanation), unsafe_allow_html=True)
+                    st.caption(
+                        f"Shading shows how much {explanation['emotion'].title()} "
+                        f"({explanation['confidence']*100:.1f}%) dropped when each word was hidden: "
+                        "red words support it, green words argue against it."
+                    )
+                    if not explanation['complete']:
+                        st.caption("The time budget ran out before every word was scored; grey words were not measured.")
+                    if explanation['truncated']:
+                        st.caption(f"Only the first {MAX_SEQUENCE_LENGTH} tokens of the entry are explained.")
 
 # CHATBOT PAGE
 elif st.session_state.current_page == 'chatbot':
@@ -2405,7 +5441,7 @@ elif st.session_state.current_page == 'chatbot':
     with col1:
         user_message = st.text_input("Type your message...", key="chat_input", placeholder="Share your thoughts...")
     with col2:
-        send_button = st.button("Send", use_container_width=True)
+        send_button = st.button("Send", use_container_width=True, disabled=model_warming)
     
     if send_button and user_message:
         st.session_state.chat_history.append({
@@ -2432,7 +5468,9 @@ elif st.session_state.current_page == 'chatbot':
             'text': user_message,
             'emotions': emotions_data,
             'risk_score': risk_score,
-            'source': 'chatbot'
+            'source': 'chatbot',
+            'embedding': get_text_embedding(user_message, model, tokenizer),
+            'embedding_model': get_model_version(model)
         })
         st.session_state.analysis_count += 1
         st.session_state.last_analysis_time = datetime.now()
@@ -2535,13 +5573,7 @@ elif st.session_state.current_page == 'questionnaire':
                 st.session_state.dass_completed = True
                 st.session_state.show_dass_mandatory = False
                 
-                users = load_users()
-                if st.session_state.username in users:
-                    users[st.session_state.username]['dass_completed'] = True
-                    if 'dass_history' not in users[st.session_state.username]:
-                        users[st.session_state.username]['dass_history'] = []
-                    users[st.session_state.username]['dass_history'].append(result)
-                    save_users(users)
+                add_dass_result(st.session_state.username, result)
                 
                 st.success("Questionnaire submitted successfully!")
                 time.sleep(1)
@@ -2836,6 +5868,24 @@ elif st.session_state.current_page == 'temporal':
                     Continue your current self-care practices and maintain regular check-ins.
                 </div>
             """, unsafe_allow_html=True)
+        
+        embedded_entries = [i for i, entry in enumerate(st.session_state.emotion_history) if entry.get('embedding') is not None]
+        if embedded_entries:
+            st.markdown("<br><h3 style='color: #1f2937;'>Find Similar Entries</h3>", unsafe_allow_html=True)
+            
+            def describe_entry(i):
+                entry = st.session_state.emotion_history[i]
+                timestamp = entry['timestamp']
+                date = timestamp.strftime('%Y-%m-%d %H:%M') if isinstance(timestamp, datetime) else str(timestamp)
+                return f"{date} — {entry['text'][:60]}"
+            
+            selected = st.selectbox("Entry", embedded_entries[::-1], format_func=describe_entry, key="similar_entry_select")
+            selected_entry = st.session_state.emotion_history[selected]
+            similar_entries = find_similar_entries(selected_entry['embedding'], selected_entry['embedding_model'], k=5, exclude=(selected,))
+            if similar_entries:
+                display_similar_entries(similar_entries)
+            else:
+                st.info("No other entries to compare with yet.")
 
 # ANALYTICS PAGE
 elif st.session_state.current_page == 'analytics':
@@ -3054,174 +6104,167 @@ elif st.session_state.current_page == 'social_media':
     
     if uploaded_file is not None:
         try:
-            df = pd.read_csv(uploaded_file)
+            # Only the first rows are parsed up front; the full file is streamed in chunks below
+            df = pd.read_csv(uploaded_file, nrows=5)
+            uploaded_file.seek(0)
             
             if 'text' not in df.columns:
                 st.error("CSV file must contain a 'text' column!")
                 st.info(f"Available columns: {', '.join(df.columns)}")
             else:
-                st.success(f"File loaded successfully! Found {len(df)} entries.")
+                st.success(f"File loaded successfully! ({uploaded_file.size / (1024 * 1024):.1f} MB)")
                 
                 with st.expander("Preview Data (First 5 rows)"):
-                    st.dataframe(df.head(), use_container_width=True)
+                    st.dataframe(df, use_container_width=True)
                 
-                if st.button("Analyze All Entries", type="primary", use_container_width=True):
+                if st.button("Analyze All Entries", type="primary", use_container_width=True, disabled=model_warming):
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     
-                    results = []
                     
-                    for idx, row in df.iterrows():
-                        status_text.text(f"Analyzing entry {idx + 1} of {len(df)}...")
-                        progress_bar.progress((idx + 1) / len(df))
+                    def show_progress(summary):
+                        status_text.text(f"Analyzed {summary['total']} entries...")
+                        progress_bar.progress(min(uploaded_file.tell() / max(uploaded_file.size, 1), 1.0))
+                    
+                    # Full results are spilled to a temporary CSV so memory stays flat for any file size
+                    results_file = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+                    results_file.close()
+                    try:
+                        summary = stream_social_media_csv(
+                            uploaded_file, model, tokenizer, emotion_labels,
+                            results_file.name, on_progress=show_progress
+                        )
                         
-                        text = clean_text(str(row['text']))
+                        progress_bar.empty()
+                        status_text.empty()
                         
-                        if text:
-                            emotions_data = predict_emotions_multilabel(text, model, tokenizer, emotion_labels, top_k=5)
-                            
-                            if emotions_data:
-                                primary_emotion = emotions_data[0]
-                                risk_score = calculate_risk_score(emotions_data)
-                                
-                                results.append({
-                                    'text': text[:100] + '...' if len(text) > 100 else text,
-                                    'primary_emotion': primary_emotion['emotion'],
-                                    'confidence': primary_emotion['confidence'],
-                                    'risk_score': risk_score,
-                                    'risk_level': primary_emotion['risk_level'],
-                                    'full_text': text
-                                })
-                        else:
-                            results.append({
-                                'text': '[Empty or invalid text]',
-                                'primary_emotion': 'N/A',
-                                'confidence': 0,
-                                'risk_score': 0,
-                                'risk_level': 'N/A',
-                                'full_text': ''
-                            })
-                    
-                    progress_bar.empty()
-                    status_text.empty()
-                    
-                    df_results = pd.DataFrame(results)
-                    
-                    st.markdown("""
-                        <div class="section-header">
-                            <div class="section-title">Analysis Results</div>
-                        </div>
-                    """, unsafe_allow_html=True)
-                    
-                    col1, col2, col3, col4 = st.columns(4)
-                    
-                    with col1:
-                        st.markdown(f"""
-                            <div class="stat-card-modern">
-                                <div class="stat-label">Total Entries</div>
-                                <div class="stat-value">{len(df_results)}</div>
-                                <div class="stat-label">Analyzed</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col2:
-                        valid_scores = df_results[df_results['risk_score'] > 0]['risk_score']
-                        avg_risk = valid_scores.mean() if len(valid_scores) > 0 else 0
-                        risk_emoji = "🔴" if avg_risk > 66 else "🟡" if avg_risk > 33 else "🟢"
-                        st.markdown(f"""
-                            <div class="stat-card-modern">
-                                <div class="stat-label">Average Risk</div>
-                                <div class="stat-value">{risk_emoji} {avg_risk:.1f}</div>
-                                <div class="stat-label">Out of 100</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col3:
-                        high_risk_count = len(df_results[df_results['risk_score'] > 66])
-                        st.markdown(f"""
-                            <div class="stat-card-modern">
-                                <div class="stat-label">High Risk</div>
-                                <div class="stat-value">🔴 {high_risk_count}</div>
-                                <div class="stat-label">Entries</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    
-                    with col4:
-                        avg_confidence = df_results[df_results['confidence'] > 0]['confidence'].mean()
-                        st.markdown(f"""
-                            <div class="stat-card-modern">
-                                <div class="stat-label">Avg Confidence</div>
-                                <div class="stat-value">{avg_confidence*100:.1f}%</div>
-                                <div class="stat-label">Model Accuracy</div>
+                        df_results = pd.DataFrame(summary['preview'], columns=SOCIAL_MEDIA_RESULT_COLUMNS)
+                        high_risk_count = summary['high_risk_count']
+                        
+                        st.markdown("""
+                            <div class="section-header">
+                                <div class="section-title">Analysis Results</div>
                             </div>
                         """, unsafe_allow_html=True)
-                    
-                    st.markdown("<br>", unsafe_allow_html=True)
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("<h3 style='color: #1f2937;'>Emotion Distribution</h3>", unsafe_allow_html=True)
-                        emotion_counts = df_results[df_results['primary_emotion'] != 'N/A']['primary_emotion'].value_counts()
-                        fig_emotions = px.pie(
-                            values=emotion_counts.values,
-                            names=emotion_counts.index,
-                            title="Primary Emotions Detected",
-                            color_discrete_sequence=px.colors.qualitative.Set3
-                        )
-                        fig_emotions.update_layout(font=dict(family="Inter"), height=400)
-                        st.plotly_chart(fig_emotions, use_container_width=True)
-                    
-                    with col2:
-                        st.markdown("<h3 style='color: #1f2937;'>Risk Level Distribution</h3>", unsafe_allow_html=True)
-                        risk_counts = df_results[df_results['risk_level'] != 'N/A']['risk_level'].value_counts()
-                        fig_risk = px.bar(
-                            x=risk_counts.index,
-                            y=risk_counts.values,
-                            labels={'x': 'Risk Level', 'y': 'Count'},
-                            color=risk_counts.index,
-                            color_discrete_map={'low': '#38ef7d', 'medium': '#ff9966', 'high': '#eb3349'}
-                        )
-                        fig_risk.update_layout(showlegend=False, font=dict(family="Inter"), height=400)
-                        st.plotly_chart(fig_risk, use_container_width=True)
-                    
-                    if high_risk_count > 0:
-                        st.markdown(f"""
-                            <div class="alert-modern alert-danger-modern">
-                                <h4 style='margin-top: 0;'>HIGH RISK ENTRIES DETECTED</h4>
-                                <p><strong>{high_risk_count} entries</strong> show signs of significant emotional distress. 
-                                Review these entries carefully and consider appropriate intervention.</p>
+                        
+                        col1, col2, col3, col4 = st.columns(4)
+                        
+                        with col1:
+                            st.markdown(f"""
+                                <div class="stat-card-modern">
+                                    <div class="stat-label">Total Entries</div>
+                                    <div class="stat-value">{summary['total']}</div>
+                                    <div class="stat-label">Analyzed</div>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        
+                        with col2:
+                            avg_risk = summary['risk_sum'] / summary['risk_count'] if summary['risk_count'] > 0 else 0
+                            risk_emoji = "🔴" if avg_risk > 66 else "🟡" if avg_risk > 33 else "🟢"
+                            st.markdown(f"""
+                                <div class="stat-card-modern">
+                                    <div class="stat-label">Average Risk</div>
+                                    <div class="stat-value">{risk_emoji} {avg_risk:.1f}</div>
+                                    <div class="stat-label">Out of 100</div>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        
+                        with col3:
+                            st.markdown(f"""
+                                <div class="stat-card-modern">
+                                    <div class="stat-label">High Risk</div>
+                                    <div class="stat-value">🔴 {high_risk_count}</div>
+                                    <div class="stat-label">Entries</div>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        
+                        with col4:
+                            avg_confidence = summary['confidence_sum'] / summary['confidence_count'] if summary['confidence_count'] > 0 else 0
+                            st.markdown(f"""
+                                <div class="stat-card-modern">
+                                    <div class="stat-label">Avg Confidence</div>
+                                    <div class="stat-value">{avg_confidence*100:.1f}%</div>
+                                    <div class="stat-label">Model Accuracy</div>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        
+                        col1, col2 = st.columns(2)
+                        
+                        with col1:
+                            st.markdown("<h3 style='color: #1f2937;'>Emotion Distribution</h3>", unsafe_allow_html=True)
+                            emotion_counts = pd.Series(summary['emotion_counts'], dtype=int).sort_values(ascending=False)
+                            fig_emotions = px.pie(
+                                values=emotion_counts.values,
+                                names=emotion_counts.index,
+                                title="Primary Emotions Detected",
+                                color_discrete_sequence=px.colors.qualitative.Set3
+                            )
+                            fig_emotions.update_layout(font=dict(family="Inter"), height=400)
+                            st.plotly_chart(fig_emotions, use_container_width=True)
+                        
+                        with col2:
+                            st.markdown("<h3 style='color: #1f2937;'>Risk Level Distribution</h3>", unsafe_allow_html=True)
+                            risk_counts = pd.Series(summary['risk_level_counts'], dtype=int).sort_values(ascending=False)
+                            fig_risk = px.bar(
+                                x=risk_counts.index,
+                                y=risk_counts.values,
+                                labels={'x': 'Risk Level', 'y': 'Count'},
+                                color=risk_counts.index,
+                                color_discrete_map={'low': '#38ef7d', 'medium': '#ff9966', 'high': '#eb3349'}
+                            )
+                            fig_risk.update_layout(showlegend=False, font=dict(family="Inter"), height=400)
+                            st.plotly_chart(fig_risk, use_container_width=True)
+                        
+                        if high_risk_count > 0:
+                            st.markdown(f"""
+                                <div class="alert-modern alert-danger-modern">
+                                    <h4 style='margin-top: 0;'>HIGH RISK ENTRIES DETECTED</h4>
+                                    <p><strong>{high_risk_count} entries</strong> show signs of significant emotional distress. 
+                                    Review these entries carefully and consider appropriate intervention.</p>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        
+                        st.markdown("<br><h3 style='color: #1f2937;'>Detailed Results</h3>", unsafe_allow_html=True)
+                        
+                        display_df = df_results[['text', 'primary_emotion', 'confidence', 'risk_score', 'risk_level']].copy()
+                        display_df['confidence'] = display_df['confidence'].apply(lambda x: f"{x*100:.1f}%" if x > 0 else "N/A")
+                        display_df['risk_score'] = display_df['risk_score'].apply(lambda x: f"{x:.1f}" if x > 0 else "N/A")
+                        display_df.columns = ['Text', 'Primary Emotion', 'Confidence', 'Risk Score', 'Risk Level']
+                        
+                        st.dataframe(display_df, use_container_width=True, height=400)
+                        if summary['total'] > len(df_results):
+                            st.caption(f"Showing the first {len(df_results)} of {summary['total']} entries. Download the CSV for the full results.")
+                        
+                        st.markdown("<br>", unsafe_allow_html=True)
+                        download = prepare_results_download(results_file.name)
+                        if download is None:
+                            st.warning(f"The full results are larger than the {SOCIAL_MEDIA_DOWNLOAD_MAX_MB} MB download limit even when zipped. Split the CSV into smaller files to download every row.")
+                        else:
+                            download_path, extension, mime = download
+                            with open(download_path, 'rb') as export:
+                                st.download_button(
+                                    label=f"Download Full Results ({extension.upper()})",
+                                    data=export,
+                                    file_name=f"social_media_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}",
+                                    mime=mime,
+                                    use_container_width=True
+                                )
+                        
+                        st.markdown("""
+                            <div class="alert-modern alert-success-modern" style='margin-top: 2rem;'>
+                                <h4 style='margin-top: 0;'>Analysis Complete</h4>
+                                <p style='margin: 0;'>
+                                    The analysis has been completed successfully. Use the insights above to understand 
+                                    emotional patterns in your social media data. Remember to handle high-risk entries with care.
+                                </p>
                             </div>
                         """, unsafe_allow_html=True)
-                    
-                    st.markdown("<br><h3 style='color: #1f2937;'>Detailed Results</h3>", unsafe_allow_html=True)
-                    
-                    display_df = df_results[['text', 'primary_emotion', 'confidence', 'risk_score', 'risk_level']].copy()
-                    display_df['confidence'] = display_df['confidence'].apply(lambda x: f"{x*100:.1f}%" if x > 0 else "N/A")
-                    display_df['risk_score'] = display_df['risk_score'].apply(lambda x: f"{x:.1f}" if x > 0 else "N/A")
-                    display_df.columns = ['Text', 'Primary Emotion', 'Confidence', 'Risk Score', 'Risk Level']
-                    
-                    st.dataframe(display_df, use_container_width=True, height=400)
-                    
-                    st.markdown("<br>", unsafe_allow_html=True)
-                    csv = df_results.to_csv(index=False).encode('utf-8')
-                    st.download_button(
-                        label="Download Full Results (CSV)",
-                        data=csv,
-                        file_name=f"social_media_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv",
-                        use_container_width=True
-                    )
-                    
-                    st.markdown("""
-                        <div class="alert-modern alert-success-modern" style='margin-top: 2rem;'>
-                            <h4 style='margin-top: 0;'>Analysis Complete</h4>
-                            <p style='margin: 0;'>
-                                The analysis has been completed successfully. Use the insights above to understand 
-                                emotional patterns in your social media data. Remember to handle high-risk entries with care.
-                            </p>
-                        </div>
-                    """, unsafe_allow_html=True)
+                    finally:
+                        for path in (results_file.name, results_file.name + '.zip'):
+                            if os.path.exists(path):
+                                os.remove(path)
         
         except Exception as e:
             st.error(f"Error processing file: {str(e)}")
@@ -3258,7 +6301,7 @@ elif st.session_state.current_page == 'social_media':
                     <li>Each row should contain one social media post/comment/tweet</li>
                     <li>Remove any empty rows before uploading</li>
                     <li>The model works best with text between 10-500 words</li>
-                    <li>Supports analysis of up to 10,000 entries at once</li>
+                    <li>Large files are processed in chunks, so there is no fixed limit on entries</li>
                 </ul>
             </div>
         """, unsafe_allow_html=True)
@@ -3557,16 +6600,13 @@ elif st.session_state.current_page == 'community':
     
     if st.button("Post to Community", use_container_width=True, type="primary"):
         if new_post and len(new_post.strip()) > 0:
-            posts = load_community_posts()
-            
             new_entry = {
                 'text': new_post.strip(),
                 'timestamp': datetime.now().isoformat(),
                 'reactions': {'❤️': 0, '🌱': 0, '💪': 0}
             }
             
-            posts.append(new_entry)
-            save_community_posts(posts)
+            add_community_post(new_entry)
             
             st.success("Your message has been posted!")
             time.sleep(1)
@@ -3611,20 +6651,17 @@ elif st.session_state.current_page == 'community':
             
             with col1:
                 if st.button(f"❤️ {post['reactions']['❤️']}", key=f"react_heart_{post_idx}"):
-                    posts[post_idx]['reactions']['❤️'] += 1
-                    save_community_posts(posts)
+                    add_community_reaction(post_idx, '❤️')
                     st.rerun()
             
             with col2:
                 if st.button(f"🌱 {post['reactions']['🌱']}", key=f"react_growth_{post_idx}"):
-                    posts[post_idx]['reactions']['🌱'] += 1
-                    save_community_posts(posts)
+                    add_community_reaction(post_idx, '🌱')
                     st.rerun()
             
             with col3:
                 if st.button(f"💪 {post['reactions']['💪']}", key=f"react_strength_{post_idx}"):
-                    posts[post_idx]['reactions']['💪'] += 1
-                    save_community_posts(posts)
+                    add_community_reaction(post_idx, '💪')
                     st.rerun()
             
             st.markdown("<br>", unsafe_allow_html=True)
@@ -3639,10 +6676,8 @@ elif st.session_state.current_page == 'mind_gym':
     """, unsafe_allow_html=True)
     
     # Load user's Mind Gym data
-    users = load_users()
-    if st.session_state.username in users:
-        user_data = users[st.session_state.username]
-        mind_gym_data = user_data.get('mind_gym', {'xp': 0, 'level': 1, 'completed_tasks': []})
+    if user_exists(st.session_state.username):
+        mind_gym_data = load_mind_gym(st.session_state.username) or {'xp': 0, 'level': 1, 'completed_tasks': []}
         st.session_state.xp_points = mind_gym_data['xp']
         st.session_state.level = mind_gym_data['level']
         completed_tasks = mind_gym_data.get('completed_tasks', [])
@@ -3780,8 +6815,7 @@ elif st.session_state.current_page == 'mind_gym':
                 if st.button("Complete", key=f"complete_{task['id']}", use_container_width=True):
                     # Mark as complete
                     completed_tasks.append(task_id)
-                    users[st.session_state.username]['mind_gym']['completed_tasks'] = completed_tasks
-                    save_users(users)
+                    save_completed_tasks(st.session_state.username, completed_tasks)
                     
                     # Award XP
                     add_xp(st.session_state.username, task['xp'])
@@ -3960,3 +6994,8 @@ elif st.session_state.current_page == 'download_report':
     """, unsafe_allow_html=True)
 
 st.markdown('</div>', unsafe_allow_html=True)
+
+if model_warming:
+    # The page is already rendered; check back shortly so it unlocks once the model is ready
+    model_preloader.wait(MODEL_READY_POLL_SECONDS)
+    st.rerun()